@@ -0,0 +1,61 @@
+import statistics
+import time
+import tracemalloc
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    if not ordered:
+        return 0.0
+    k = (len(ordered) - 1) * pct / 100
+    lo = int(k)
+    hi = min(lo + 1, len(ordered) - 1)
+    return ordered[lo] + (ordered[hi] - ordered[lo]) * (k - lo)
+
+def measure(fn, *args, repeat=50, warmup=3):
+    for _ in range(warmup):
+        fn(*args)
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn(*args)
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples)
+
+def summarize(samples_ms):
+    total_s = sum(samples_ms) / 1000
+    return {
+        "runs": len(samples_ms),
+        "mean_ms": round(statistics.fmean(samples_ms), 3),
+        "p50_ms": round(percentile(samples_ms, 50), 3),
+        "p95_ms": round(percentile(samples_ms, 95), 3),
+        "p99_ms": round(percentile(samples_ms, 99), 3),
+        "max_ms": round(max(samples_ms), 3),
+        "ops_per_s": round(len(samples_ms) / total_s, 1) if total_s else 0.0,
+    }
+
+def print_table(rows, columns=("p50_ms", "p95_ms", "ops_per_s")):
+    width = max(len(name) for name in rows) + 2
+    print("".ljust(width) + "".join(c.rjust(12) for c in columns))
+    for name, stats in rows.items():
+        print(name.ljust(width) + "".join(str(stats.get(c, "")).rjust(12) for c in columns))
+
+async def measure_async(fn, *args, repeat=50, warmup=3):
+    for _ in range(warmup):
+        await fn(*args)
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        await fn(*args)
+        samples.append((time.perf_counter() - started) * 1000)
+    return summarize(samples)
+
+def peak_memory(fn, *args) -> float:
+    # Peak Python-level allocation of one call, in KiB.
+    tracemalloc.start()
+    try:
+        fn(*args)
+        return round(tracemalloc.get_traced_memory()[1] / 1024, 1)
+    finally:
+        tracemalloc.stop()
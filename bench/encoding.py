@@ -0,0 +1,54 @@
+import argparse
+import io
+
+from PIL import Image
+
+from bench.common import measure, print_table
+from utils.encoding import EncodingPolicy
+
+SPECS = ("png:1", "png:6", "png:9", "webp:75", "webp:90", "webp-lossless", "jpeg:85")
+
+def sample_images() -> dict:
+    import cardgen
+    from bench.run import LONG_TITLES, cover_bytes
+    from server.join import render_welcome_image
+
+    cover = cover_bytes()
+    card, _ = cardgen.render_spotify_card(cover, None, LONG_TITLES[0], ["Artist One", "Artist Two"], 61, 245)
+    welcome = render_welcome_image(cover_bytes(128), "benchmark_user", 123456789012345678)
+    return {name: Image.open(io.BytesIO(data)).copy() for name, data in (("card", card), ("welcome", welcome))}
+
+def _optimized_png(image):
+    buf = io.BytesIO()
+    image.save(buf, format="PNG", optimize=True)
+    return buf.getvalue()
+
+def run(repeat: int = 10, mbps: float = 10.0) -> dict:
+    # Upload time is estimated from the size at `mbps`; the sum is what a
+    # user waits for between render and message, ignoring Discord itself.
+    results = {}
+    for name, image in sample_images().items():
+        cases = {"png-optimize/full": (_optimized_png, image)}
+        for tier in ("full", "compact"):
+            for spec in SPECS:
+                policy = EncodingPolicy.parse(spec, tier)
+                cases[f"{spec}/{tier}"] = (policy.encode, image)
+
+        for case, (fn, arg) in cases.items():
+            stats = measure(fn, arg, repeat=repeat, warmup=1)
+            size = len(fn(arg))
+            stats["kb"] = round(size / 1024, 1)
+            stats["upload_ms"] = round(size * 8 / (mbps * 1e6) * 1000, 1)
+            stats["total_ms"] = round(stats["p50_ms"] + stats["upload_ms"], 1)
+            results[f"{name}:{case}"] = stats
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode time against upload size for generated images.")
+    parser.add_argument("--repeat", type=int, default=10)
+    parser.add_argument("--mbps", type=float, default=10.0, help="uplink used to estimate upload time")
+    args = parser.parse_args()
+    print_table(run(args.repeat, args.mbps), ("p50_ms", "kb", "upload_ms", "total_ms"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+import json
+import os
+import random
+
+FIXTURE_DIR = os.path.join(os.path.dirname(__file__), "fixtures")
+
+WORDS = (
+    "night light heart fire road rain dance slow city dream gold river "
+    "echo shadow summer falling alone tonight forever radio neon ocean"
+).split()
+
+def _line(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(4, 9))).capitalize()
+
+def _verse(rng, label):
+    lines = [f"[{label}]"] + [_line(rng) for _ in range(rng.randint(4, 8))]
+    out = []
+    for line in lines:
+        if rng.random() < 0.3:
+            out.append(f'<a href="/{rng.randint(1, 10**7)}" class="ReferentFragment"><span>{line}</span></a>')
+        elif rng.random() < 0.1:
+            out.append(f"<i>{line}</i>")
+        else:
+            out.append(line.replace("&", "&amp;"))
+    return "<br/>".join(out)
+
+def _blob(rng, size):
+    state = {"songPage": {"tracking": [], "related": []}}
+    while len(json.dumps(state)) < size:
+        state["songPage"]["related"].append({
+            "id": rng.randint(1, 10**8),
+            "title": _line(rng),
+            "url": f"https://genius.com/{rng.randint(1, 10**8)}",
+            "stats": {"pageviews": rng.randint(1, 10**6), "hot": rng.random() < 0.5},
+        })
+    return json.dumps(state).replace("<", "\\u003c")
+
+# (containers, blob_kb, verses per container). The last page's containers
+# run well past the stream extractor's 4 KB chunks, so text runs get split
+# across feeds.
+SYNTHETIC_PAGES = [(2, 80, 2), (3, 200, 2), (5, 400, 2), (2, 80, 60)]
+
+def genius_page(seed: int = 0, containers: int = 3, blob_kb: int = 200, verses: int = 2) -> str:
+    # Shaped like a Genius song page: a heavy head, navigation, the lyrics
+    # split over several containers with ads in between, then a large
+    # preloaded-state script. Lyrics are random placeholder words.
+    rng = random.Random(seed)
+    head = "".join(f'<meta name="m{i}" content="{_line(rng)}">' for i in range(60))
+    head += "".join(f'<link rel="preload" href="/assets/{i}.js">' for i in range(30))
+    head += f"<script>window.__CONFIG__ = {_blob(rng, blob_kb * 256)};</script>"
+    nav = "".join(f'<li><a href="/tag/{w}">{w}</a></li>' for w in WORDS)
+
+    blocks = []
+    for i in range(containers):
+        header = ""
+        if i == 0:
+            header = (
+                '<div data-exclude-from-selection="true"><div class="Contributors">'
+                f'{rng.randint(10, 400)} Contributors</div><span>Translations</span>'
+                f"<h2>Placeholder Song Lyrics</h2></div>"
+            )
+        body = "<br/><br/>".join(_verse(rng, f"Verse {i * verses + j + 1}") for j in range(verses))
+        blocks.append(f'<div data-lyrics-container="true" class="Lyrics__Container">{header}{body}</div>')
+        blocks.append('<div class="RightSidebar"><div class="Ad"><iframe src="/ad"></iframe></div></div>')
+
+    tail = "".join(f'<div class="Recommendation"><a href="/{i}">{_line(rng)}</a></div>' for i in range(80))
+    tail += f"<script>window.__PRELOADED_STATE__ = JSON.parse('{_blob(rng, blob_kb * 768)}');</script>"
+    return (
+        f"<!DOCTYPE html><html><head>{head}</head><body>"
+        f'<header><nav><ul>{nav}</ul></nav></header><main><div class="SongPage">'
+        f"{''.join(blocks)}</div></main><footer>{tail}</footer></body></html>"
+    )
+
+def load_pages(directory: str = FIXTURE_DIR) -> dict:
+    # Real pages saved into bench/fixtures are used as-is; synthetic ones
+    # are generated there when missing (and in any other empty directory).
+    os.makedirs(directory, exist_ok=True)
+    if directory != FIXTURE_DIR and any(n.endswith(".html") for n in os.listdir(directory)):
+        return _read_pages(directory)
+    for seed, (containers, blob_kb, verses) in enumerate(SYNTHETIC_PAGES):
+        path = os.path.join(directory, f"synthetic_{seed}.html")
+        if not os.path.exists(path):
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(genius_page(seed, containers, blob_kb, verses))
+    return _read_pages(directory)
+
+def _read_pages(directory: str) -> dict:
+    names = sorted(n for n in os.listdir(directory) if n.endswith(".html"))
+    pages = {}
+    for name in names:
+        with open(os.path.join(directory, name), encoding="utf-8") as f:
+            pages[name] = f.read()
+    return pages
@@ -0,0 +1,37 @@
+import argparse
+
+from bench.common import measure, print_table
+from bench.fixtures import FIXTURE_DIR, load_pages
+from utils.lyrics import EXTRACTORS, extract_lyrics
+
+def run(directory: str = FIXTURE_DIR, repeat: int = 20) -> dict:
+    results = {}
+    for page_name, html in load_pages(directory).items():
+        baseline = extract_lyrics(html, EXTRACTORS["soup"]())
+        for name, cls in EXTRACTORS.items():
+            extractor = cls()
+            if extract_lyrics(html, extractor) != baseline:
+                raise AssertionError(f"{name} extractor disagrees with soup on {page_name}")
+            stats = measure(extract_lyrics, html, extractor, repeat=repeat)
+            stats["page_kb"] = round(len(html) / 1024, 1)
+            results[f"{page_name}:{name}"] = stats
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark lyrics extraction on saved pages.")
+    parser.add_argument("--pages", default=FIXTURE_DIR, help="directory of saved .html pages")
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    results = run(args.pages, args.repeat)
+    print_table(results, ("page_kb", "p50_ms", "p95_ms", "ops_per_s"))
+
+    pages = {key.rsplit(":", 1)[0] for key in results}
+    for page in sorted(pages):
+        soup = results[f"{page}:soup"]["p50_ms"]
+        for name in EXTRACTORS:
+            if name != "soup":
+                print(f"{page} {name}: {soup / results[f'{page}:{name}']['p50_ms']:.1f}x faster than soup")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+import argparse
+import asyncio
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import resource
+import sqlite3
+import subprocess
+import tempfile
+import time
+
+from PIL import Image
+
+from bench.common import measure, measure_async, peak_memory, print_table
+from bench.fixtures import FIXTURE_DIR
+
+RESULTS_DIR = os.path.join(os.path.dirname(__file__), "results")
+
+LONG_TITLES = (
+    "Tell Me Why (Taylor's Version) [From The Vault] - Extended Acoustic Session Recording",
+    "Symphony No. 9 in D Minor, Op. 125 \"Choral\": IV. Presto - Allegro assai - Ode an die Freude",
+    "A Very Long Song Title That Keeps Going And Going Until It Has To Be Truncated Somewhere",
+)
+
+def cover_bytes(size: int = 640) -> bytes:
+    # Smooth gradients, roughly what album art compresses like.
+    image = Image.merge("RGB", (
+        Image.linear_gradient("L").resize((size, size)),
+        Image.radial_gradient("L").resize((size, size)),
+        Image.linear_gradient("L").rotate(90).resize((size, size)),
+    ))
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=90)
+    return output.getvalue()
+
+def run_case(loop, results, name, fn, *args, repeat, is_async=False):
+    if is_async:
+        stats = loop.run_until_complete(measure_async(fn, *args, repeat=repeat))
+        stats["peak_kb"] = peak_memory(lambda: loop.run_until_complete(fn(*args)))
+    else:
+        stats = measure(fn, *args, repeat=repeat)
+        stats["peak_kb"] = peak_memory(fn, *args)
+    results[name] = stats
+    print(f"  {name}: p50 {stats['p50_ms']}ms")
+
+def bench_cards(loop, results, repeat):
+    import cardgen
+    from utils.covercache import CoverCache
+    from utils.render import RenderEngine
+
+    cover = cover_bytes()
+    run_case(loop, results, "card.render_cold", cardgen.render_spotify_card,
+             cover, None, LONG_TITLES[0], ["Artist One", "Artist Two"], 61, 245, repeat=repeat)
+
+    # The async path with the network stubbed out: every fetch returns the
+    # same cover, so after the first call the fitted backdrop is cached.
+    cache = CoverCache(path=tempfile.mkdtemp(prefix="covers-"))
+    async def fetch(url):
+        return cover
+    cache.fetch = fetch
+    cardgen.covers = cache
+    cardgen.engine = RenderEngine(workers=0)
+    run_case(loop, results, "card.generate_cached", cardgen.generate_spotify_card,
+             "Song", ["Artist"], "https://example.invalid/cover.jpg", 61, 245, repeat=repeat, is_async=True)
+
+    layer = cardgen.render_card_layer(cover, None, LONG_TITLES[0], ["Artist One", "Artist Two"], 61, 245)[2]
+    run_case(loop, results, "card.progress_only", cardgen.render_progress, layer, 62, 245, repeat=repeat)
+    run_case(loop, results, "card.generate_track_cached", cardgen.generate_spotify_card,
+             "Song", ["Artist"], "https://example.invalid/cover.jpg", 61, 245, "track", repeat=repeat, is_async=True)
+    cardgen.engine.shutdown()
+
+    titles = [random.choice(LONG_TITLES) + f" #{i}" for i in range(200)]
+    def fit_all():
+        for title in titles:
+            cardgen.fit_text(title, cardgen.BOLD, 1040, 72, 40)
+    run_case(loop, results, "card.fit_text_200_cold", lambda: (cardgen.layout_text.cache_clear(), fit_all()), repeat=repeat)
+    run_case(loop, results, "card.fit_text_200_warm", fit_all, repeat=repeat)
+
+    def gradient_cold():
+        cardgen.gradient_alpha.cache_clear()
+        cardgen.create_true_gradient(*cardgen.CARD_SIZE)
+    run_case(loop, results, "card.gradient_cold", gradient_cold, repeat=repeat)
+    run_case(loop, results, "card.gradient_warm", cardgen.create_true_gradient, *cardgen.CARD_SIZE, repeat=repeat)
+
+def bench_welcome(loop, results, repeat):
+    from server import join
+    from utils.render import RenderEngine
+
+    avatar = cover_bytes(128)
+
+    class StubHTTP:
+        async def get_bytes(self, url):
+            return avatar
+
+    class Avatar:
+        url = "https://example.invalid/avatar.png"
+        def with_size(self, size):
+            return self
+
+    class Member:
+        id = 123456789012345678
+        name = "benchmark_user"
+        discriminator = "0"
+        mention = "<@123456789012345678>"
+        display_avatar = Avatar()
+
+    join.http = StubHTTP()
+    join.engine = RenderEngine(workers=0)
+    run_case(loop, results, "welcome.generate", join.generate_welcome_image, Member(), repeat=repeat, is_async=True)
+    run_case(loop, results, "welcome.collage_24", join.render_welcome_collage,
+             [avatar] * 24, [f"member_{i}" for i in range(24)], repeat=max(repeat // 5, 3))
+    join.engine.shutdown()
+
+def build_economy(path: str, users: int, seed: int = 1):
+    from server.storage import init_db
+
+    rng = random.Random(seed)
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    init_db(conn)
+    now = datetime.datetime.now(datetime.timezone.utc)
+    conn.execute("BEGIN")
+    conn.executemany(
+        "INSERT INTO economy (user_id, balance, last_daily) VALUES (?, ?, ?)",
+        (
+            (10**17 + i, int(rng.paretovariate(1.2) * 50),
+             (now - datetime.timedelta(hours=rng.randint(0, 72))).isoformat() if rng.random() < 0.3 else None)
+            for i in range(users)
+        ),
+    )
+    conn.execute("COMMIT")
+    conn.close()
+
+def bench_economy(loop, results, repeat, users):
+    from server.storage import EconomyStore
+
+    directory = tempfile.mkdtemp(prefix="economy-")
+    path = os.path.join(directory, "economy.db")
+    started = time.perf_counter()
+    build_economy(path, users)
+    print(f"  built {users} users in {time.perf_counter() - started:.1f}s")
+
+    store = EconomyStore(path)
+    rng = random.Random(2)
+    pick = lambda: 10**17 + rng.randrange(users)
+    now = datetime.datetime.now(datetime.timezone.utc)
+
+    async def reads():
+        for _ in range(20):
+            await store.get_user(pick())
+
+    async def credits():
+        for _ in range(20):
+            await store.credit(pick(), 10)
+
+    async def debits():
+        for _ in range(20):
+            await store.debit_if_sufficient(pick(), 5, 10)
+
+    async def transfers():
+        for _ in range(20):
+            await store.transfer(pick(), pick(), 1)
+
+    async def dailies():
+        for _ in range(20):
+            await store.claim_daily(pick(), 100, now, datetime.timedelta(days=1))
+
+    async def concurrent_credits():
+        await asyncio.gather(*(store.credit(pick(), 1) for _ in range(200)))
+
+    for name, fn in (("read_x20", reads), ("credit_x20", credits), ("debit_x20", debits),
+                     ("transfer_x20", transfers), ("daily_x20", dailies),
+                     ("credit_gather_200", concurrent_credits)):
+        run_case(loop, results, f"economy.{name}", fn, repeat=repeat, is_async=True)
+
+    run_case(loop, results, "economy.rank_rebuild", lambda: store.refresh_ranks(force=True),
+             repeat=max(repeat // 10, 3), is_async=True)
+    total = loop.run_until_complete(store.rank_total())
+    run_case(loop, results, "economy.leaderboard_page",
+             lambda: store.ranks_after(rng.randrange(max(total - 10, 1)), 10), repeat=repeat, is_async=True)
+    run_case(loop, results, "economy.rank_of", lambda: store.rank_of(pick()), repeat=repeat, is_async=True)
+
+    results["economy.meta"] = {"users": users, "db_mb": round(os.path.getsize(path) / 2**20, 1)}
+    store.close()
+
+def bench_lyrics(loop, results, repeat, pages):
+    from bench.lyrics import run as run_lyrics
+    for name, stats in run_lyrics(pages, repeat).items():
+        results[f"lyrics.{name}"] = stats
+
+def bench_encoding(loop, results, repeat):
+    from bench.encoding import run as run_encoding
+    for name, stats in run_encoding(max(repeat // 3, 3)).items():
+        results[f"encoding.{name}"] = stats
+
+def git_revision() -> str | None:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(results: dict, baseline_path: str):
+    with open(baseline_path) as f:
+        baseline = json.load(f)["results"]
+    print(f"\nvs {baseline_path}")
+    for name, stats in results.items():
+        old = baseline.get(name, {}).get("p50_ms")
+        if old and "p50_ms" in stats:
+            change = (stats["p50_ms"] - old) / old * 100
+            print(f"  {name.ljust(40)} {old:>10} -> {stats['p50_ms']:<10} {change:+.1f}%")
+
+SUITES = ("cards", "welcome", "economy", "lyrics", "encoding")
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline benchmarks for renderers, economy and lyrics parsing.")
+    parser.add_argument("--only", nargs="+", choices=SUITES, default=SUITES)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--users", type=int, default=100_000, help="synthetic economy size")
+    parser.add_argument("--pages", default=FIXTURE_DIR, help="directory of saved .html pages")
+    parser.add_argument("--out", help="result file (default bench/results/<timestamp>.json)")
+    parser.add_argument("--compare", help="earlier result file to diff p50 against")
+    args = parser.parse_args()
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    results = {}
+    for suite in args.only:
+        print(f"{suite}:")
+        if suite == "cards":
+            bench_cards(loop, results, args.repeat)
+        elif suite == "welcome":
+            bench_welcome(loop, results, args.repeat)
+        elif suite == "economy":
+            bench_economy(loop, results, args.repeat, args.users)
+        elif suite == "lyrics":
+            bench_lyrics(loop, results, args.repeat, args.pages)
+        elif suite == "encoding":
+            bench_encoding(loop, results, args.repeat)
+    loop.close()
+
+    print()
+    print_table({k: v for k, v in results.items() if "p50_ms" in v}, ("p50_ms", "p95_ms", "p99_ms", "ops_per_s", "peak_kb"))
+
+    report = {
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "args": vars(args),
+        "results": results,
+    }
+    out = args.out or os.path.join(RESULTS_DIR, time.strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nmax RSS {report['max_rss_mb']} MB, saved {out}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+if __name__ == "__main__":
+    main()
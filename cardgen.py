@@ -1,76 +1,112 @@
 import discord
 import io
-import aiohttp
-from PIL import Image, ImageDraw, ImageFont, ImageOps
-
-def rounded_rectangle(image, radius):
-    mask = Image.new('L', image.size, 0)
+import os
+from functools import lru_cache
+from PIL import Image, ImageDraw, ImageOps
+
+from utils.covercache import ByteLRU, covers
+from utils.encoding import policy_for
+from utils.fonts import BOLD, REGULAR, layout_text, load_font
+from utils.pngsplice import compress_prefix, finish_png
+from utils.render import engine
+
+@lru_cache(maxsize=8)
+def rounded_mask(size, radius):
+    mask = Image.new('L', size, 0)
     draw = ImageDraw.Draw(mask)
-    draw.rounded_rectangle([(0, 0), image.size], radius, fill=255)
-    image.putalpha(mask)
-    return image
-
-def load_font(possible_names, size):
-    for name in possible_names:
-        try:
-            return ImageFont.truetype(name, size)
-        except Exception:
-            continue
-    return ImageFont.load_default()
-
-def fit_text(draw, text, font_paths, max_width, max_size, min_size):
-    size = max_size
-    while size >= min_size:
-        font = load_font(font_paths, size)
-        width = draw.textlength(text, font=font)
-        if width <= max_width:
-            return font, text
-        size -= 2
-    font = load_font(font_paths, min_size)
-    ellipsis = "..."
-    display_text = text
-    while draw.textlength(display_text + ellipsis, font=font) > max_width and len(display_text) > 0:
-        display_text = display_text[:-1]
-    return font, display_text + ellipsis
+    draw.rounded_rectangle([(0, 0), size], radius, fill=255)
+    return mask
+
+def fit_text(text, font_paths, max_width, max_size, min_size):
+    size, display_text = layout_text(text, tuple(font_paths), max_width, max_size, min_size)
+    return load_font(font_paths, size), display_text
+
+@lru_cache(maxsize=8)
+def gradient_alpha(width, height):
+    # Build one row of the falloff and stretch it, instead of drawing
+    # every column separately.
+    row = bytes(int(255 * (1 - (x / width)) ** 3.5) for x in range(width))
+    return Image.frombytes('L', (width, 1), row).resize((width, height), Image.NEAREST)
+
+@lru_cache(maxsize=8)
+def black_layer(width, height):
+    return Image.new("RGBA", (width, height), (0, 0, 0, 255))
 
 def create_true_gradient(width, height):
-    grad = Image.new("RGBA", (width, height), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(grad)
-    for x in range(width):
-        alpha = int(255 * (1 - (x / width)) ** 3.5)
-        draw.line([(x, 0), (x, height)], fill=(0, 0, 0, alpha))
+    grad = black_layer(width, height).copy()
+    grad.putalpha(gradient_alpha(width, height))
     return grad
 
-async def generate_spotify_card(title, artists, album_url, elapsed, duration):
-    width, height = 1200, 600
+def shade_cover(cover):
+    # Same result as alpha-compositing the gradient over an opaque cover,
+    # done as a single composite against the cached layers.
+    return Image.composite(black_layer(*cover.size), cover, gradient_alpha(*cover.size))
+
+CARD_SIZE = (1200, 600)
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(album_url) as resp:
-            cover_data = await resp.read()
+def fit_cover(cover_data, size):
     cover = Image.open(io.BytesIO(cover_data)).convert("RGBA")
-    cover = ImageOps.fit(cover, (width, height), centering=(0.5, 0.5), method=Image.LANCZOS)
+    return ImageOps.fit(cover, size, centering=(0.5, 0.5), method=Image.LANCZOS)
+
+CARD_RADIUS = 40
+CARD_LAYER_BYTES = int(os.getenv("CARD_LAYER_BYTES", str(32 * 1024 * 1024)))
+CARD_POLICY = policy_for("sp")
 
-    card = Image.new("RGBA", (width, height))
-    card.paste(cover, (0, 0))
+# Everything above the bottom DYNAMIC_HEIGHT rows (cover, gradient, title,
+# artists) only depends on the track; the progress bar and times below it
+# change on every request.
+DYNAMIC_HEIGHT = 100
 
-    grad = create_true_gradient(width, height)
-    card = Image.alpha_composite(card, grad)
+class CardLayer:
+    # The static part of a card: the top rows (already filtered and
+    # compressed for spliceable PNG, raw pixels otherwise) and the bottom
+    # strip before the progress bar is drawn.
+    __slots__ = ("prefix", "top", "strip")
+
+    def __init__(self, prefix, top, strip):
+        self.prefix = prefix
+        self.top = top
+        self.strip = strip
+
+    def __len__(self):
+        return len(self.prefix or self.top) + len(self.strip)
+
+def build_card_layer(cover_data, backdrop, title, artists, size=CARD_SIZE, policy=CARD_POLICY, splice=True):
+    # `splice` compresses the top up front for PNG; only worth it when the
+    # layer will be cached and reused.
+    width, height = size
+
+    fitted = None
+    if backdrop is not None:
+        cover = Image.frombytes("RGBA", size, backdrop)
+    else:
+        cover = fit_cover(cover_data, size)
+        fitted = cover.tobytes()
+
+    card = shade_cover(cover)
 
     draw = ImageDraw.Draw(card)
-    font_bold_names = [
-        "fonts/DejaVuSans-Bold.ttf"
-    ]
-    font_regular_names = [
-        "fonts/DejaVuSans.ttf"
-    ]
-
-    font_title, display_title = fit_text(draw, title, font_bold_names, 1040, 84, 40)
+    font_title, display_title = fit_text(title, BOLD, width - 160, 84, 40)
     draw.text((80, 120), display_title, font=font_title, fill=(255, 255, 255, 255))
 
-    font_artist = load_font(font_regular_names, 40)
+    font_artist = load_font(REGULAR, 40)
     draw.text((80, 120 + font_title.size + 20), ", ".join(artists), font=font_artist, fill=(220, 220, 220, 255))
 
-    bar_y = height - 80
+    split = height - DYNAMIC_HEIGHT
+    top = card.crop((0, 0, width, split))
+    top.putalpha(rounded_mask(size, CARD_RADIUS).crop((0, 0, width, split)))
+    strip = card.crop((0, split, width, height)).tobytes()
+    if splice and policy.spliceable:
+        return CardLayer(compress_prefix(top, policy.value), None, strip), fitted
+    return CardLayer(None, top.tobytes(), strip), fitted
+
+def render_progress(layer, elapsed, duration, size=CARD_SIZE, policy=CARD_POLICY):
+    width, height = size
+    split = height - DYNAMIC_HEIGHT
+    strip = Image.frombytes("RGBA", (width, DYNAMIC_HEIGHT), layer.strip)
+    draw = ImageDraw.Draw(strip)
+
+    bar_y = height - 80 - split
     bar_x = 80
     bar_w = width - 2 * bar_x
     bar_h = 8
@@ -83,16 +119,64 @@ async def generate_spotify_card(title, artists, album_url, elapsed, duration):
     draw.line([(knob_x, bar_y + bar_h // 2), (bar_x + bar_w, bar_y + bar_h // 2)], fill=(255, 255, 255, 100), width=2)
     draw.ellipse([knob_x - knob_r, knob_y - knob_r + 4, knob_x + knob_r, knob_y + knob_r + 4], fill=(255, 255, 255, 230))
 
-    font_time = load_font(font_regular_names, 32)
+    font_time = load_font(REGULAR, 32)
     elapsed_str = f"{int(elapsed // 60):02}:{int(elapsed % 60):02}"
     duration_str = f"{int(duration // 60):02}:{int(duration % 60):02}"
     draw.text((bar_x, bar_y + 20), elapsed_str, font=font_time, fill=(255, 255, 255, 180))
     time_w = draw.textlength(duration_str, font=font_time)
     draw.text((bar_x + bar_w - time_w, bar_y + 20), duration_str, font=font_time, fill=(255, 255, 255, 180))
 
-    card = rounded_rectangle(card, 40)
-
-    buf = io.BytesIO()
-    card.save(buf, format="PNG", optimize=True)
-    buf.seek(0)
-    return discord.File(buf, filename="spotify_card.png")
+    strip.putalpha(rounded_mask(size, CARD_RADIUS).crop((0, split, width, height)))
+    if layer.prefix is not None:
+        return finish_png(layer.prefix, strip, policy.value)
+
+    card = Image.new("RGBA", size)
+    card.paste(Image.frombytes("RGBA", (width, split), layer.top), (0, 0))
+    card.paste(strip, (0, split))
+    return policy.encode(card)
+
+def render_card_layer(cover_data, backdrop, title, artists, elapsed, duration, size=CARD_SIZE, policy=CARD_POLICY):
+    layer, fitted = build_card_layer(cover_data, backdrop, title, artists, size, policy)
+    return render_progress(layer, elapsed, duration, size, policy), fitted, layer
+
+def render_spotify_card(cover_data, backdrop, title, artists, elapsed, duration, size=CARD_SIZE, policy=CARD_POLICY):
+    layer, fitted = build_card_layer(cover_data, backdrop, title, artists, size, policy, splice=False)
+    return render_progress(layer, elapsed, duration, size, policy), fitted
+
+def warm():
+    # Fills the per-process caches the first card would otherwise pay for.
+    create_true_gradient(*CARD_SIZE)
+    load_font(BOLD, 72)
+    load_font(REGULAR, 40)
+    load_font(REGULAR, 32)
+
+card_layers = ByteLRU(CARD_LAYER_BYTES)
+layer_counters = {"layer_hits": 0, "layer_misses": 0}
+
+async def generate_spotify_card(title, artists, album_url, elapsed, duration, track_id=None, policy=CARD_POLICY):
+    # A track seen recently only needs its progress strip drawn and
+    # encoded on top of its cached layer.
+    filename = policy.filename("spotify_card")
+    key = (track_id, CARD_SIZE, policy.spliceable)
+    layer = card_layers.get(key) if track_id else None
+    if layer is not None:
+        layer_counters["layer_hits"] += 1
+        data = await engine.submit(render_progress, layer, elapsed, duration, CARD_SIZE, policy)
+        return discord.File(io.BytesIO(data), filename=filename)
+
+    backdrop = covers.get_backdrop(album_url, CARD_SIZE)
+    cover_data = None if backdrop is not None else await covers.fetch(album_url)
+
+    if track_id:
+        layer_counters["layer_misses"] += 1
+        data, fitted, layer = await engine.submit(
+            render_card_layer, cover_data, backdrop, title, list(artists), elapsed, duration, CARD_SIZE, policy
+        )
+        card_layers.put(key, layer)
+    else:
+        data, fitted = await engine.submit(
+            render_spotify_card, cover_data, backdrop, title, list(artists), elapsed, duration, CARD_SIZE, policy
+        )
+    if fitted is not None:
+        covers.put_backdrop(album_url, CARD_SIZE, fitted)
+    return discord.File(io.BytesIO(data), filename=filename)
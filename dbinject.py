@@ -1,20 +1,58 @@
-import sqlite3
+import argparse
+import sys
 
-DB_PATH = "data/economy.db"
+from server.db_inject import CHUNK_SIZE, GrantError, give_balls, grant, open_source, read_grants
+from server.guilds import guild_db_path
 
-def give_balls(user_id: int, bonus_balls: int):
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT balance FROM economy WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        if row:
-            new_balance = row[0] + bonus_balls
-            cur.execute("UPDATE economy SET balance = ? WHERE user_id = ?", (new_balance, user_id))
-            print(f"Gave {bonus_balls} balls to {user_id}. New balance: {new_balance}")
+# Bulk ball grants, e.g. event payouts:
+#   python dbinject.py winners.csv --guild 123456789012345678 --payout halloween-2026
+#   python dbinject.py winners.jsonl --guild 123456789012345678 --payout halloween-2026 --dry-run
+#   python dbinject.py --guild 123456789012345678 --user 1186872689038729237 --delta 1000
+# CSV rows are user_id,delta[,key] (a header line is fine); JSONL lines are
+# {"user_id": ..., "delta": ..., "key": ...}. Rows without a key are keyed
+# by "<payout>:<user_id>" (plus ":2", ":3"... for a user's later rows), so
+# the same payout can't be applied twice.
+#
+# Grants go straight to the database. If the bot runs with
+# ECONOMY_WRITE_BEHIND=1, users it has cached won't see them until they
+# are evicted; run payouts with the bot stopped or write-behind off.
+
+def main():
+    parser = argparse.ArgumentParser(description="Grant balls in bulk from a CSV or JSONL file.")
+    parser.add_argument("file", nargs="?", help="grants file, or - for stdin")
+    parser.add_argument("--payout", help="name of this payout, used to key rows that have no key")
+    parser.add_argument("--format", choices=("csv", "jsonl"), help="input format (default: from the extension)")
+    parser.add_argument("--user", type=int, help="grant a single user instead of reading a file")
+    parser.add_argument("--delta", type=int, help="amount for --user")
+    parser.add_argument("--guild", type=int, help="guild whose economy to grant in")
+    parser.add_argument("--db", help="economy DB file, instead of --guild")
+    parser.add_argument("--chunk", type=int, default=CHUNK_SIZE, help="rows per transaction")
+    parser.add_argument("--dry-run", action="store_true", help="run everything, then roll back")
+    args = parser.parse_args()
+    if args.guild is None and args.db is None:
+        parser.error("give --guild (or --db)")
+    path = args.db or guild_db_path(args.guild)
+
+    try:
+        if args.user is not None:
+            if args.delta is None:
+                parser.error("--user needs --delta")
+            stats = give_balls(args.user, args.delta, args.payout, path, args.dry_run)
+        elif args.file:
+            with open_source(args.file) as source:
+                stats = grant(read_grants(source, args.format), args.payout, path, args.chunk, args.dry_run)
         else:
-            cur.execute("INSERT INTO economy (user_id, balance, last_daily) VALUES (?, ?, NULL)", (user_id, bonus_balls))
-            print(f"User {user_id} didn't exist. Created and gave {bonus_balls} balls.")
+            parser.error("give a grants file or --user/--delta")
+    except GrantError as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
 
-#give_balls(1313117547486515273, 500)
+    prefix = "DRY RUN, nothing written. " if args.dry_run else ""
+    print(
+        f"{prefix}{stats['read']} rows read, {stats['applied']} applied, {stats['skipped']} already applied, "
+        f"{stats['invalid']} invalid, {stats['created']} new users, {stats['total_delta']:+,} balls in "
+        f"{stats['chunks']} chunks; {stats['seconds']}s ({stats['rows_per_s']:,} rows/s)"
+    )
 
-give_balls(1186872689038729237, 1000)
\ No newline at end of file
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,28 @@
+from utils.startup import startup
+
+import argparse
+import importlib
 import discord
 from discord.ext import commands
 from datetime import datetime, timezone
 import os
-import aiohttp
-import io
-import re
+import sys
+import asyncio
+import time
 
 from dotenv import load_dotenv
-from cardgen import generate_spotify_card
 from utils.lyrics import fetch
-from server.join import handle_member_join
+from utils.render import RenderQueueFull, engine
+from utils.httpclient import http
+from utils.covercache import covers
+from utils.lyricstore import lyrics_store
+from utils.metrics import metrics, metrics_server
+from utils.commandsync import sync_if_changed
+from utils.cooldowns import cooldowns
 from server import economy
+from server.balancecache import BalanceCache
+from server.guilds import MigrationConflict, economies, migrate_legacy
+from server.users import directory
 
 from utils.fun import (
     dad_joke, vibe_cmd, fortune_cmd, waifu_cmd, husbando_cmd,
@@ -20,39 +32,168 @@ from utils.fun import (
 load_dotenv()
 
 DISCORD_KEY = os.getenv("DISCORD_KEY")
-GUILD_ID = int(os.getenv("GUILD_ID"))
+# The guild the old single-guild data/economy.db belongs to; it's migrated
+# to that guild's own file on first start. Optional for new deployments.
+GUILD_ID = int(os.getenv("GUILD_ID", "0"))
+# Unset: one process runs every shard. To split shards across processes,
+# give each the same SHARD_COUNT and its own SHARD_IDS, e.g. "0,1".
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS = [int(i) for i in os.getenv("SHARD_IDS", "").split(",") if i.strip()] or None
+
+parser = argparse.ArgumentParser(description="Run the Fozi bot.")
+parser.add_argument("--force-sync", action="store_true", help="sync application commands even if they look unchanged")
+args = parser.parse_args()
+
+startup.mark("imports")
 
 intents = discord.Intents.default()
 intents.presences = True
 intents.members = True
 intents.message_content = True
 
-bot = commands.Bot(command_prefix='.', intents=intents)
+class MetricsTree(discord.app_commands.CommandTree):
+    # Slash command timing: the clock starts in the global check and stops
+    # on completion or in the error handler.
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.type is discord.InteractionType.application_command:
+            name = interaction.data.get("name", "?")
+            interaction.extras["metrics_started"] = time.perf_counter()
+            metrics.gauge_add("command_in_flight", 1, kind="slash", command=name)
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: discord.app_commands.AppCommandError):
+        metrics.inc("command_errors_total", kind="slash", command=interaction.data.get("name", "?"))
+        finish_slash(interaction)
+        await super().on_error(interaction, error)
+
+class CommandThrottled(commands.CheckFailure):
+    def __init__(self, retry_after: float):
+        super().__init__(f"On cooldown for {retry_after:.0f}s")
+        self.retry_after = retry_after
+
+def finish_slash(interaction: discord.Interaction):
+    started = interaction.extras.pop("metrics_started", None)
+    if started is not None:
+        name = interaction.data.get("name", "?")
+        metrics.observe("command_ms", (time.perf_counter() - started) * 1000, kind="slash", command=name)
+        metrics.gauge_add("command_in_flight", -1, kind="slash", command=name)
+
+class Fozi(commands.AutoShardedBot):
+    lag_task = None
+    warm_task = None
+    join_queue = None
+
+    async def login(self, token):
+        with startup.phase("login"):
+            await super().login(token)
+
+    def owns_guild(self, guild_id: int) -> bool:
+        # Whether this process runs the shard that guild_id's events go to.
+        if self.shard_ids is None:
+            return True
+        return (guild_id >> 22) % self.shard_count in self.shard_ids
+
+    async def setup_hook(self):
+        with startup.phase("setup_hook"):
+            await http.start()
+            await metrics_server.start()
+            self.lag_task = asyncio.create_task(metrics.loop_lag_monitor())
+            if GUILD_ID and self.owns_guild(GUILD_ID):
+                try:
+                    if await asyncio.to_thread(migrate_legacy, GUILD_ID):
+                        print(f"Migrated data/economy.db to guild {GUILD_ID}")
+                except MigrationConflict as e:
+                    print(f"!!! Legacy economy NOT migrated: {e}")
+            economies.start()
+
+            # Registered once per process; syncing only happens when the
+            # payload changed since the last sync (or with --force-sync), so
+            # reconnects don't touch the command endpoints at all. Commands
+            # are global; syncing GUILD_ID clears what was registered there
+            # before. With shards split over processes, only the one running
+            # shard 0 syncs.
+            economy.register_commands(self)
+            if self.shard_ids is None or 0 in self.shard_ids:
+                guilds = [discord.Object(id=GUILD_ID)] if GUILD_ID else []
+                synced = await sync_if_changed(self.tree, guilds, force=args.force_sync)
+                print(f"Synced commands for: {', '.join(synced)}" if synced else "Commands unchanged, skipped sync")
+
+    async def warm_up(self):
+        # Runs once after the first on_ready. Imaging and the databases are
+        # loaded here instead of before connecting; anything that needs them
+        # earlier imports or opens them on first use.
+        with startup.phase("warm:imaging"):
+            cardgen = await asyncio.to_thread(importlib.import_module, "cardgen")
+            join = await asyncio.to_thread(importlib.import_module, "server.join")
+        with startup.phase("warm:join_queue"):
+            join.join_queue.start(self)
+            self.join_queue = join.join_queue
+        with startup.phase("warm:render_pool"):
+            await asyncio.gather(*(engine.submit(cardgen.warm) for _ in range(max(engine.workers, 1))))
+        with startup.phase("warm:lyrics_db"):
+            await lyrics_store.purge()
+        print("Startup phases:\n" + startup.report())
+
+    async def invoke(self, ctx):
+        # Errors are handled (and counted) in on_command_error; invoke
+        # itself doesn't raise for them.
+        if ctx.command is None:
+            return await super().invoke(ctx)
+        with metrics.track("command", kind="prefix", command=ctx.command.qualified_name):
+            await super().invoke(ctx)
+
+    async def on_command_error(self, ctx, error):
+        if isinstance(error, CommandThrottled):
+            return await ctx.send(f"Slow down! Try again in {error.retry_after:.0f}s.", delete_after=10)
+        if ctx.command is not None:
+            metrics.inc("command_errors_total", kind="prefix", command=ctx.command.qualified_name)
+        await super().on_command_error(ctx, error)
+
+    async def close(self):
+        for task in (self.lag_task, self.warm_task):
+            if task:
+                task.cancel()
+        if self.join_queue:
+            self.join_queue.stop()
+        await super().close()
+        await http.close()
+        engine.shutdown()
+        lyrics_store.close()
+        await economies.close()
+        directory.close()
+        await metrics_server.close()
+
+bot = Fozi(command_prefix='.', intents=intents, tree_cls=MetricsTree, shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+
+@bot.check
+async def prefix_cooldown(ctx):
+    # Per-user limits for the prefix commands, checked in memory before the
+    # command runs. The owner is exempt.
+    if await bot.is_owner(ctx.author):
+        return True
+    retry = cooldowns.hit(ctx.command.qualified_name, ctx.author.id)
+    if retry:
+        raise CommandThrottled(retry)
+    return True
+
+@bot.event
+async def on_app_command_completion(interaction, command):
+    finish_slash(interaction)
 
 @bot.event
 async def on_member_join(member):
+    from server.join import handle_member_join
     await handle_member_join(bot, member)
 
 @bot.event
 async def on_ready():
-    print(f'Logged in as {bot.user}')
-    
-    bot.tree.clear_commands(guild=None)
-    
-    guild = discord.Object(id=GUILD_ID)
-    bot.tree.clear_commands(guild=guild)
-    
-    economy.register_commands(bot)
-    
-    await bot.tree.sync()
-    await bot.tree.sync(guild=guild)
-    print("Commands cleared and synced")
+    print(f'Logged in as {bot.user} ({len(bot.shards)} shards, {len(bot.guilds)} guilds)')
+    if bot.warm_task is None:
+        startup.mark("gateway")
+        bot.warm_task = asyncio.create_task(bot.warm_up())
 
 @bot.command()
 async def sp(ctx):
-    if ctx.guild is None or ctx.guild.id != GUILD_ID:
-        return await ctx.send("This command is only available in the main server.")
-
     user = ctx.author
 
     if not hasattr(user, 'activities') or not user.activities:
@@ -67,13 +208,18 @@ async def sp(ctx):
     elapsed = (now - spotify.start).total_seconds()
     duration = (spotify.end - spotify.start).total_seconds()
 
-    file = await generate_spotify_card(
-        title=spotify.title,
-        artists=spotify.artists,
-        album_url=spotify.album_cover_url,
-        elapsed=elapsed,
-        duration=duration
-    )
+    from cardgen import generate_spotify_card
+    try:
+        file = await generate_spotify_card(
+            title=spotify.title,
+            artists=spotify.artists,
+            album_url=spotify.album_cover_url,
+            elapsed=elapsed,
+            duration=duration,
+            track_id=spotify.track_id
+        )
+    except RenderQueueFull:
+        return await ctx.send("Too many cards are being rendered right now, try again in a moment.")
 
     view = discord.ui.View()
     view.add_item(discord.ui.Button(label="Open in Spotify", url=f"https://open.spotify.com/track/{spotify.track_id}"))
@@ -82,9 +228,6 @@ async def sp(ctx):
 
 @bot.command()
 async def lyrics(ctx):
-    if ctx.guild is None or ctx.guild.id != GUILD_ID:
-        return await ctx.send("This command is only available in the main server.")
-
     user = ctx.author
 
     if not hasattr(user, 'activities') or not user.activities:
@@ -99,14 +242,11 @@ async def lyrics(ctx):
     artist = spotify.artists[0]
     thumbnail = spotify.album_cover_url
 
-    lyrics = await fetch(artist, title)
+    lyrics = await lyrics_store.get(artist, title, fetch)
 
     if not lyrics:
         return await ctx.send(f"No lyrics available for: {title} by {artist}")
 
-    lyrics = re.sub(r"(?si)^.*?\bLyrics\b", "", lyrics).strip()
-    lyrics = re.sub(r"(?si)(translations|read more|\d+ contributors|\b[a-z]+ \(.*?\))", "", lyrics).strip()
-
     embed = discord.Embed(
         title=f"{title} - {artist}",
         description=lyrics[:4090],
@@ -116,6 +256,76 @@ async def lyrics(ctx):
     embed.set_thumbnail(url=thumbnail)
     await ctx.send(embed=embed)
 
+@bot.command()
+@commands.is_owner()
+async def cachestats(ctx):
+    stats = {f"covers.{k}": v for k, v in covers.stats().items()}
+    cardgen = sys.modules.get("cardgen")
+    if cardgen:
+        stats.update({f"cards.{k}": v for k, v in cardgen.layer_counters.items()})
+        stats["cards.layer_bytes"] = cardgen.card_layers.size
+    stats.update({f"lyrics.{k}": v for k, v in lyrics_store.stats().items()})
+    stats.update({f"users.{k}": v for k, v in directory.stats().items()})
+    stats.update({f"economies.{k}": v for k, v in economies.stats().items()})
+    stats.update({f"cooldowns.{k}": v for k, v in cooldowns.stats().items()})
+    # Balance cache and ledger counters summed over the open economies.
+    for guild_economy in economies:
+        if isinstance(guild_economy.bank, BalanceCache):
+            for k, v in guild_economy.bank.stats().items():
+                stats[f"balances.{k}"] = stats.get(f"balances.{k}", 0) + v
+        for k, v in guild_economy.store.ledger.stats().items():
+            stats[f"ledger.{k}"] = stats.get(f"ledger.{k}", 0) + v
+        for k, v in guild_economy.cooldowns.stats().items():
+            stats[f"economy_cooldowns.{k}"] = stats.get(f"economy_cooldowns.{k}", 0) + v
+    lines = [f"{name}: {value:,}" for name, value in stats.items()]
+    await ctx.send("```\n" + "\n".join(lines) + "\n```")
+
+@bot.command()
+@commands.is_owner()
+async def httpstats(ctx):
+    lines = [
+        f"{host}: {s['requests']} req, {s['errors']} err, avg {s['avg_ms']}ms, max {s['max_ms']}ms"
+        for host, s in http.stats().items()
+    ]
+    await ctx.send("```\n" + ("\n".join(lines) or "No requests yet.") + "\n```")
+
+@bot.command()
+@commands.is_owner()
+async def metricstats(ctx):
+    lines = []
+    for name in ("command", "db_call"):
+        for labels, count, errors, in_flight, p50, p95, peak in metrics.summary(name):
+            label = " ".join(str(v) for v in labels.values())
+            lines.append(f"{label}: {count} calls, {errors} err, {in_flight} running, p50 {p50}ms, p95 {p95}ms, max {peak}ms")
+    for (hist_name, labels), hist in sorted(metrics.histograms.items(), key=lambda item: item[0]):
+        if hist_name == "http_request_ms":
+            lines.append(f"http {dict(labels)['host']}: {hist.count} req, p50 {hist.quantile(0.5):.1f}ms, p95 {hist.quantile(0.95):.1f}ms")
+    lag = metrics.histogram("event_loop_lag_ms")
+    if lag:
+        lines.append(f"loop lag: p50 {lag.quantile(0.5):.1f}ms, p95 {lag.quantile(0.95):.1f}ms, max {lag.max:.1f}ms")
+    text = "\n".join(lines) or "No samples yet."
+    await ctx.send("```\n" + text[:1980] + "\n```")
+
+@bot.command()
+@commands.is_owner()
+@commands.guild_only()
+async def ledgercheck(ctx):
+    guild_economy = economies.get(ctx.guild.id)
+    if isinstance(guild_economy.bank, BalanceCache):
+        await guild_economy.bank.flush()
+    drift = await guild_economy.store.ledger.drift()
+    if not drift:
+        return await ctx.send("Ledger matches every stored balance.")
+    lines = [f"{user_id}: stored {balance}, ledger {derived}" for user_id, balance, derived in drift[:20]]
+    await ctx.send(f"{len(drift)} balances disagree with the ledger:\n```\n" + "\n".join(lines) + "\n```")
+
+@bot.command()
+@commands.is_owner()
+@commands.guild_only()
+async def ledgercompact(ctx):
+    archived = await economies.get(ctx.guild.id).store.ledger.compact()
+    await ctx.send(f"Archived {archived} ledger entries.")
+
 @bot.command()
 async def dadjoke(ctx):
     await ctx.send(embed=dad_joke(ctx.author))
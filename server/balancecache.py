@@ -0,0 +1,188 @@
+import asyncio
+import datetime
+import os
+from collections import Counter, OrderedDict
+
+ECONOMY_WRITE_BEHIND = os.getenv("ECONOMY_WRITE_BEHIND", "0") == "1"
+ECONOMY_FLUSH_INTERVAL = float(os.getenv("ECONOMY_FLUSH_INTERVAL", "5"))
+ECONOMY_FLUSH_THRESHOLD = int(os.getenv("ECONOMY_FLUSH_THRESHOLD", "100"))
+ECONOMY_CACHE_USERS = int(os.getenv("ECONOMY_CACHE_USERS", "10000"))
+
+class _Entry:
+    __slots__ = ("balance", "last_daily", "delta", "daily_dirty")
+
+    def __init__(self, balance, last_daily):
+        self.balance = balance
+        self.last_daily = last_daily
+        self.delta = 0
+        self.daily_dirty = False
+
+class BalanceCache:
+    # Authoritative in-memory balances for active users, with the same
+    # balance API as EconomyStore. Changes are kept as per-user deltas and
+    # written back in one transaction every `interval` seconds, once
+    # `threshold` users are dirty, and on close. A crash loses at most the
+    # changes made since the last flush.
+    def __init__(self, store, interval: float = ECONOMY_FLUSH_INTERVAL,
+                 threshold: int = ECONOMY_FLUSH_THRESHOLD, max_users: int = ECONOMY_CACHE_USERS):
+        self.store = store
+        self.ledger = store.ledger
+        self.interval = interval
+        self.threshold = threshold
+        self.max_users = max_users
+        self.counters = {"hits": 0, "loads": 0, "flushes": 0, "flushed_rows": 0}
+        self._entries = OrderedDict()
+        self._dirty = set()
+        self._flushing = set()
+        self._loading = {}
+        self._pinned = Counter()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._loop_task = None
+
+    async def _entry(self, user_id):
+        entry = self._entries.get(user_id)
+        if entry is None:
+            task = self._loading.get(user_id)
+            if task is None:
+                self.counters["loads"] += 1
+                task = asyncio.ensure_future(self.store.get_user(user_id))
+                self._loading[user_id] = task
+                task.add_done_callback(lambda _: self._loading.pop(user_id, None))
+            balance, last_daily = await asyncio.shield(task)
+
+            entry = self._entries.get(user_id)
+            if entry is None:
+                entry = self._entries[user_id] = _Entry(balance, last_daily)
+                self._evict(keep=user_id)
+        else:
+            self.counters["hits"] += 1
+        self._entries.move_to_end(user_id)
+        return entry
+
+    def _evict(self, keep):
+        if len(self._entries) <= self.max_users:
+            return
+        for user_id in list(self._entries):
+            if len(self._entries) <= self.max_users:
+                break
+            if (user_id != keep and user_id not in self._dirty and user_id not in self._flushing
+                    and user_id not in self._pinned):
+                del self._entries[user_id]
+
+    async def _entries_for(self, *user_ids):
+        # Loads several users for one operation. They stay pinned until all
+        # are loaded, so loading the second can't evict the first; the
+        # caller checks and changes them without awaiting in between.
+        self._pinned.update(user_ids)
+        try:
+            for user_id in user_ids:
+                await self._entry(user_id)
+        finally:
+            for user_id in user_ids:
+                self._pinned[user_id] -= 1
+                if not self._pinned[user_id]:
+                    del self._pinned[user_id]
+        return [self._entries[user_id] for user_id in user_ids]
+
+    def _change(self, user_id, delta, last_daily=None):
+        # Always changes the entry in the map: flush() reads deltas from
+        # there, so a change to an evicted entry would be lost.
+        entry = self._entries[user_id]
+        entry.balance += delta
+        entry.delta += delta
+        if last_daily is not None:
+            entry.last_daily = last_daily
+            entry.daily_dirty = True
+        self._dirty.add(user_id)
+        if len(self._dirty) >= self.threshold and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.ensure_future(self.flush())
+        return entry
+
+    async def get_user(self, user_id: int):
+        entry = await self._entry(user_id)
+        return entry.balance, entry.last_daily
+
+    async def credit(self, user_id: int, amount: int, kind: str = "adjust") -> int:
+        entry = await self._entry(user_id)
+        delta = max(amount, -entry.balance)
+        entry = self._change(user_id, delta)
+        self.ledger.record(user_id, delta, entry.balance, kind)
+        return entry.balance
+
+    async def debit_if_sufficient(self, user_id: int, amount: int, payout: int = 0, kind: str = "adjust") -> int | None:
+        entry = await self._entry(user_id)
+        if entry.balance < amount:
+            return None
+        entry = self._change(user_id, payout - amount)
+        self.ledger.record(user_id, payout - amount, entry.balance, kind)
+        return entry.balance
+
+    async def transfer(self, src: int, dst: int, amount: int, kind: str = "transfer"):
+        src_entry, dst_entry = await self._entries_for(src, dst)
+        if src_entry.balance < amount:
+            return None
+        src_entry = self._change(src, -amount)
+        dst_entry = self._change(dst, amount)
+        self.ledger.record(src, -amount, src_entry.balance, kind, dst)
+        self.ledger.record(dst, amount, dst_entry.balance, kind, src)
+        return src_entry.balance, dst_entry.balance
+
+    async def claim_daily(self, user_id: int, reward: int, now: datetime.datetime, cooldown: datetime.timedelta):
+        entry = await self._entry(user_id)
+        if entry.last_daily and datetime.datetime.fromisoformat(entry.last_daily) > now - cooldown:
+            return False, entry.balance, entry.last_daily
+        entry = self._change(user_id, reward, now.isoformat())
+        self.ledger.record(user_id, reward, entry.balance, "daily")
+        return True, entry.balance, entry.last_daily
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self._dirty:
+                return 0
+
+            batch, self._dirty = self._dirty, set()
+            rows = []
+            for user_id in batch:
+                entry = self._entries[user_id]
+                rows.append((user_id, entry.delta, entry.last_daily if entry.daily_dirty else None))
+                entry.delta = 0
+                entry.daily_dirty = False
+
+            self._flushing = batch
+            try:
+                await self.store.apply_deltas(rows)
+            except BaseException:
+                for user_id, delta, last_daily in rows:
+                    entry = self._entries[user_id]
+                    entry.delta += delta
+                    entry.daily_dirty = entry.daily_dirty or last_daily is not None
+                self._dirty |= batch
+                raise
+            finally:
+                self._flushing = set()
+
+            self.counters["flushes"] += 1
+            self.counters["flushed_rows"] += len(rows)
+            return len(rows)
+
+    async def run(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Balance flush failed, will retry: {e}")
+
+    def start(self):
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self.run())
+
+    async def close(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            self._loop_task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {**self.counters, "cached": len(self._entries), "dirty": len(self._dirty)}
@@ -1,18 +1,161 @@
+import csv
+import io
+import json
+import os
 import sqlite3
+import sys
+import time
+from collections import Counter
+from itertools import islice
 
-DB_PATH = "data/economy.db"
-
-def give_balls(user_id: int, bonus_balls: int):
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT balance FROM economy WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        if row:
-            new_balance = row[0] + bonus_balls
-            cur.execute("UPDATE economy SET balance = ? WHERE user_id = ?", (new_balance, user_id))
-            print(f"Gave {bonus_balls} balls to {user_id}. New balance: {new_balance}")
-        else:
-            cur.execute("INSERT INTO economy (user_id, balance, last_daily) VALUES (?, ?, NULL)", (user_id, bonus_balls))
-            print(f"User {user_id} didn't exist. Created and gave {bonus_balls} balls.")
-
-give_balls(1186872689038729237, 1000)
\ No newline at end of file
+from server.ledger import INSERT_ENTRY
+from server.storage import CREDIT, DB_PATH, init_db
+from utils.dbthread import DEFAULT_PRAGMAS
+
+CHUNK_SIZE = 1000
+# Each chunk's keys go into one IN (...) list; stay under SQLite's
+# variable limit.
+MAX_CHUNK_SIZE = 30000
+BUSY_TIMEOUT_MS = 10000
+
+INSERT_KEY = "INSERT INTO grant_keys (key, user_id, delta, applied_at) VALUES (?, ?, ?, ?)"
+
+class GrantError(Exception):
+    pass
+
+def _rows_csv(lines):
+    reader = csv.reader(lines)
+    for lineno, row in enumerate(reader, 1):
+        if not row or row[0].startswith("#"):
+            continue
+        if lineno == 1 and not row[0].strip().lstrip("-").isdigit():
+            continue  # header
+        yield lineno, row[0], row[1] if len(row) > 1 else None, row[2] if len(row) > 2 else None
+
+def _rows_jsonl(lines):
+    for lineno, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            item = json.loads(line)
+        except ValueError:
+            yield lineno, None, None, None
+            continue
+        if not isinstance(item, dict):
+            yield lineno, None, None, None
+            continue
+        yield lineno, item.get("user_id"), item.get("delta"), item.get("key")
+
+def read_grants(source, format: str | None = None):
+    # Yields (lineno, user_id, delta, key) from a CSV or JSONL stream
+    # without loading it; malformed rows come back with user_id None.
+    name = getattr(source, "name", "")
+    format = format or ("jsonl" if str(name).endswith((".jsonl", ".json")) else "csv")
+    rows = _rows_jsonl(source) if format == "jsonl" else _rows_csv(source)
+    for lineno, user_id, delta, key in rows:
+        try:
+            yield lineno, int(user_id), int(delta), str(key) if key not in (None, "") else None
+        except (TypeError, ValueError):
+            yield lineno, None, None, None
+
+def connect(path: str = DB_PATH) -> sqlite3.Connection:
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, isolation_level=None)
+    for pragma in DEFAULT_PRAGMAS:
+        conn.execute(pragma)
+    conn.execute(f"PRAGMA busy_timeout={BUSY_TIMEOUT_MS}")
+    init_db(conn)
+    return conn
+
+def _apply_chunk(conn, chunk, dry_run, stats):
+    keys = [key for key, _, _ in chunk]
+    user_ids = list({user_id for _, user_id, _ in chunk})
+
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        marks = ",".join("?" * len(keys))
+        seen = {row[0] for row in conn.execute(f"SELECT key FROM grant_keys WHERE key IN ({marks})", keys)}
+        fresh = [row for row in chunk if row[0] not in seen]
+
+        marks = ",".join("?" * len(user_ids))
+        existing = dict(conn.execute(f"SELECT user_id, balance FROM economy WHERE user_id IN ({marks})", user_ids))
+
+        # Ledger balances follow CREDIT's clamping at 0, row by row.
+        balances = dict(existing)
+        entries = []
+        now = time.time()
+        for key, user_id, delta in fresh:
+            before = balances.get(user_id, 0)
+            balances[user_id] = max(0, before + delta)
+            entries.append((user_id, balances[user_id] - before, balances[user_id], "grant", None, now))
+
+        conn.executemany(INSERT_KEY, ((key, user_id, delta, now) for key, user_id, delta in fresh))
+        conn.executemany(CREDIT, ((user_id, delta, delta) for _, user_id, delta in fresh))
+        conn.executemany(INSERT_ENTRY, entries)
+        conn.execute("ROLLBACK" if dry_run else "COMMIT")
+    except BaseException:
+        if conn.in_transaction:
+            conn.execute("ROLLBACK")
+        raise
+
+    stats["applied"] += len(fresh)
+    stats["skipped"] += len(chunk) - len(fresh)
+    stats["created"] += len({user_id for _, user_id, _ in fresh} - existing.keys())
+    stats["total_delta"] += sum(entry[1] for entry in entries)
+    stats["chunks"] += 1
+
+def grant(rows, payout: str | None, path: str = DB_PATH, chunk_size: int = CHUNK_SIZE, dry_run: bool = False) -> dict:
+    # Each grant is keyed by its own `key`, or by "<payout>:<user_id>" when
+    # the row has none; a user's second keyless row in the same file gets
+    # "<payout>:<user_id>:2", and so on. Keys already recorded in grant_keys
+    # (from an earlier run or earlier in this file) are skipped, so
+    # re-running a payout is safe.
+    # Chunks commit independently; an interrupted run can simply be re-run.
+    stats = {"read": 0, "invalid": 0, "applied": 0, "skipped": 0, "created": 0, "total_delta": 0, "chunks": 0}
+    started = time.perf_counter()
+    conn = connect(path)
+    seen = set()
+    per_user = Counter()
+
+    def keyed():
+        for lineno, user_id, delta, key in rows:
+            stats["read"] += 1
+            if user_id is None:
+                stats["invalid"] += 1
+                print(f"line {lineno}: skipped, expected user_id and integer delta", file=sys.stderr)
+                continue
+            if key is None:
+                if payout is None:
+                    raise GrantError(f"line {lineno}: no key column and no --payout name to derive one")
+                per_user[user_id] += 1
+                n = per_user[user_id]
+                key = f"{payout}:{user_id}" if n == 1 else f"{payout}:{user_id}:{n}"
+            if key in seen:
+                stats["skipped"] += 1
+                continue
+            seen.add(key)
+            yield key, user_id, delta
+
+    chunk_size = max(1, min(chunk_size, MAX_CHUNK_SIZE))
+    try:
+        it = keyed()
+        while chunk := list(islice(it, chunk_size)):
+            _apply_chunk(conn, chunk, dry_run, stats)
+    finally:
+        conn.close()
+
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    stats["rows_per_s"] = round(stats["read"] / stats["seconds"], 1) if stats["seconds"] else 0.0
+    return stats
+
+def give_balls(user_id: int, bonus_balls: int, payout: str | None = None, path: str = DB_PATH,
+               dry_run: bool = False) -> dict:
+    # Without a payout name every call is a new grant.
+    key = f"{payout}:{user_id}" if payout else f"manual:{user_id}:{time.time_ns()}"
+    return grant([(0, user_id, bonus_balls, key)], payout, path, dry_run=dry_run)
+
+def open_source(path: str):
+    if path == "-":
+        return io.TextIOWrapper(sys.stdin.buffer, encoding="utf-8", newline="")
+    return open(path, encoding="utf-8", newline="")
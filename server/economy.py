@@ -3,80 +3,102 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
-import sqlite3
 import random
 import datetime
-import os
-
-DB_PATH = os.path.join("data", "economy.db")
-os.makedirs("data", exist_ok=True)
-
-def init_db():
-    with sqlite3.connect(DB_PATH) as conn:
-        conn.execute('''
-            CREATE TABLE IF NOT EXISTS economy (
-                user_id INTEGER PRIMARY KEY,
-                balance INTEGER DEFAULT 0,
-                last_daily TEXT
-            )
-        ''')
-
-init_db()
-
-def get_user(user_id):
-    with sqlite3.connect(DB_PATH) as conn:
-        cur = conn.cursor()
-        cur.execute("SELECT balance, last_daily FROM economy WHERE user_id = ?", (user_id,))
-        row = cur.fetchone()
-        if not row:
-            conn.execute("INSERT INTO economy (user_id, balance, last_daily) VALUES (?, 0, NULL)", (user_id,))
-            return 0, None
-        return row
-
-def update_user(user_id, balance=None, last_daily=None):
-    with sqlite3.connect(DB_PATH) as conn:
-        if balance is not None and last_daily is not None:
-            conn.execute("UPDATE economy SET balance = ?, last_daily = ? WHERE user_id = ?", (balance, last_daily, user_id))
-        elif balance is not None:
-            conn.execute("UPDATE economy SET balance = ? WHERE user_id = ?", (balance, user_id))
-        elif last_daily is not None:
-            conn.execute("UPDATE economy SET last_daily = ? WHERE user_id = ?", (last_daily, user_id))
-
-class BallFlipDropdown(discord.ui.Select):
-    def __init__(self, bet_amount: int, user_id: int):
-        self.bet_amount = bet_amount
+import time
+
+from server.guilds import economies
+from server.storage import LEADERBOARD_REFRESH
+from server.users import directory
+from utils.cooldowns import limit_for
+
+# The database enforces the same window, so /daily stays correct before a
+# guild's cooldowns have loaded.
+DAILY_LIMIT = limit_for("daily")
+DAILY_COOLDOWN = datetime.timedelta(seconds=DAILY_LIMIT.per if DAILY_LIMIT else 86400)
+PAGE_SIZE = 10
+BALLFLIP_TIMEOUT = 60
+HISTORY_SIZE = 15
+KIND_LABELS = {
+    "daily": "Daily",
+    "flip": "Ball flip",
+    "rob": "Robbery",
+    "rob_fine": "Robbery fine",
+    "grant": "Grant",
+    "adjust": "Adjustment",
+    "transfer": "Transfer",
+}
+
+def too_poor_embed(victim):
+    return discord.Embed(
+        title="Target Too Poor!",
+        description=f"{victim.display_name} is too broke to be robbed dude.",
+        color=discord.Color.red()
+    )
+
+async def throttled(interaction: discord.Interaction, command: str) -> bool:
+    # Answers from memory when the user is over the command's limit; the
+    # caller returns without touching the database.
+    retry = economies.get(interaction.guild_id).cooldowns.hit(command, interaction.user.id)
+    if not retry:
+        return False
+    await interaction.response.send_message(
+        f"Slow down! You can use `/{command}` again <t:{int(time.time() + retry) + 1}:R>.", ephemeral=True
+    )
+    return True
+
+class BallFlipChoice(discord.ui.DynamicItem[discord.ui.Select], template=r"ballflip:(?P<user_id>\d+):(?P<bet>\d+):(?P<expires>\d+)"):
+    # The owner, bet and expiry live in the custom_id, so an open ballflip
+    # costs no memory and still works after a restart.
+    def __init__(self, user_id: int, bet_amount: int, expires: int, disabled: bool = False):
         self.user_id = user_id
-        
+        self.bet_amount = bet_amount
+        self.expires = expires
+
         options = [
             discord.SelectOption(label="Heads", description="Bet on heads", emoji="🪙"),
             discord.SelectOption(label="Tails", description="Bet on tails", emoji="🎯")
         ]
-        
-        super().__init__(placeholder="Choose heads or tails...", options=options)
+
+        super().__init__(discord.ui.Select(
+            placeholder="Choose heads or tails...",
+            options=options,
+            custom_id=f"ballflip:{user_id}:{bet_amount}:{expires}",
+            disabled=disabled
+        ))
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Select, match):
+        return cls(int(match["user_id"]), int(match["bet"]), int(match["expires"]))
 
     async def callback(self, interaction: discord.Interaction):
         if interaction.user.id != self.user_id:
             await interaction.response.send_message("This isn't your ballflip!", ephemeral=True)
             return
-            
-        guess = self.values[0].lower()
-        bal, _ = get_user(self.user_id)
-        
-        if self.bet_amount > bal:
-            await interaction.response.send_message("You don't have enough balls for this bet anymore!", ephemeral=True)
+
+        if time.time() > self.expires:
+            self.item.disabled = True
+            await interaction.response.edit_message(view=self.view)
+            await interaction.followup.send("This ballflip has expired, start a new one with `/ballflip`.", ephemeral=True)
             return
-        
+
+        guess = self.item.values[0].lower()
         result = random.choice(["heads", "tails"])
+        won = guess == result
+
+        bank = economies.get(interaction.guild_id).bank
+        bal = await bank.debit_if_sufficient(self.user_id, self.bet_amount, payout=2 * self.bet_amount if won else 0, kind="flip")
+        if bal is None:
+            await interaction.response.send_message("You don't have enough balls for this bet anymore!", ephemeral=True)
+            return
         
-        if guess == result:
-            bal += self.bet_amount
+        if won:
             embed = discord.Embed(
                 title="You Won! :3",
                 description=f"The coin landed on **{result.title()}**!\nYou won **{self.bet_amount}** balls!",
                 color=discord.Color.green()
             )
         else:
-            bal -= self.bet_amount
             embed = discord.Embed(
                 title="You Lost! :[",
                 description=f"The coin landed on **{result.title()}**!\nYou lost **{self.bet_amount}** balls.",
@@ -85,146 +107,113 @@ class BallFlipDropdown(discord.ui.Select):
         
         embed.add_field(name="New Balance", value=f"**{bal}** balls", inline=False)
         
-        update_user(self.user_id, balance=bal)
-        
-        self.disabled = True
+        self.item.disabled = True
         await interaction.response.edit_message(embed=embed, view=self.view)
 
-class BallFlipView(discord.ui.View):
-    def __init__(self, bet_amount: int, user_id: int):
-        super().__init__(timeout=60.0)  # 60 second timeout
-        self.add_item(BallFlipDropdown(bet_amount, user_id))
-        self.user_id = user_id
-    
-    async def on_timeout(self):
-        for item in self.children:
-            item.disabled = True
-
-class LeaderboardView(discord.ui.View):
-    def __init__(self, bot, total_pages: int, current_page: int = 0):
-        super().__init__(timeout=120.0)
-        self.bot = bot
-        self.total_pages = total_pages
-        self.current_page = current_page
-        
-        self.update_buttons()
-    
-    def update_buttons(self):
-        self.clear_items()
-        
-        prev_button = discord.ui.Button(
-            label="< Previous", 
-            style=discord.ButtonStyle.secondary,
-            disabled=(self.current_page == 0)
-        )
-        prev_button.callback = self.previous_page
-        self.add_item(prev_button)
-        
-        page_button = discord.ui.Button(
-            label=f"Page {self.current_page + 1}/{self.total_pages}",
-            style=discord.ButtonStyle.primary,
-            disabled=True
-        )
-        self.add_item(page_button)
-        
-        next_button = discord.ui.Button(
-            label="Next >", 
-            style=discord.ButtonStyle.secondary,
-            disabled=(self.current_page == self.total_pages - 1)
-        )
-        next_button.callback = self.next_page
-        self.add_item(next_button)
-    
-    async def previous_page(self, interaction: discord.Interaction):
-        if self.current_page > 0:
-            self.current_page -= 1
-            self.update_buttons()
-            embed = await self.create_leaderboard_embed()
-            await interaction.response.edit_message(embed=embed, view=self)
-        else:
-            await interaction.response.defer()
-    
-    async def next_page(self, interaction: discord.Interaction):
-        if self.current_page < self.total_pages - 1:
-            self.current_page += 1
-            self.update_buttons()
-            embed = await self.create_leaderboard_embed()
-            await interaction.response.edit_message(embed=embed, view=self)
+def ballflip_view(bet_amount: int, user_id: int) -> discord.ui.View:
+    view = discord.ui.View(timeout=None)
+    view.add_item(BallFlipChoice(user_id, bet_amount, int(time.time() + BALLFLIP_TIMEOUT)))
+    return view
+
+class LeaderboardButton(discord.ui.DynamicItem[discord.ui.Button], template=r"leaderboard:(?P<direction>before|after|page):(?P<rank>\d+)"):
+    # Previous/Next carry the first/last rank on screen and seek from it
+    # rather than paging with OFFSET; nothing is kept per message.
+    def __init__(self, direction: str, rank: int, label: str = "", disabled: bool = False):
+        self.direction = direction
+        self.rank = rank
+        style = discord.ButtonStyle.primary if direction == "page" else discord.ButtonStyle.secondary
+        super().__init__(discord.ui.Button(
+            label=label,
+            style=style,
+            custom_id=f"leaderboard:{direction}:{rank}",
+            disabled=disabled
+        ))
+
+    @classmethod
+    async def from_custom_id(cls, interaction: discord.Interaction, item: discord.ui.Button, match):
+        return cls(match["direction"], int(match["rank"]), item.label, item.disabled)
+
+    async def callback(self, interaction: discord.Interaction):
+        store = economies.get(interaction.guild_id).store
+        if self.direction == "before":
+            rows = await store.ranks_before(self.rank, PAGE_SIZE)
         else:
+            rows = await store.ranks_after(self.rank, PAGE_SIZE)
+        if not rows:
             await interaction.response.defer()
+            return
+
+        total_pages = (await store.rank_total() + PAGE_SIZE - 1) // PAGE_SIZE
+        embed = await leaderboard_embed(interaction.client, interaction.guild, store, rows, total_pages)
+        await interaction.response.edit_message(embed=embed, view=leaderboard_view(rows, total_pages))
+
+def leaderboard_view(rows, total_pages: int) -> discord.ui.View:
+    current_page = (rows[0][0] - 1) // PAGE_SIZE if rows else 0
+    first = rows[0][0] if rows else 1
+    last = rows[-1][0] if rows else 0
+
+    view = discord.ui.View(timeout=None)
+    view.add_item(LeaderboardButton("before", first, "< Previous", disabled=(current_page == 0)))
+    view.add_item(LeaderboardButton("page", current_page, f"Page {current_page + 1}/{total_pages}", disabled=True))
+    view.add_item(LeaderboardButton("after", last, "Next >", disabled=(current_page >= total_pages - 1)))
+    return view
+
+async def leaderboard_embed(bot, guild, store, users, total_pages: int):
+    embed = discord.Embed(
+        title="Ball Leaderboard",
+        description="People with the most BALLS!",
+        color=discord.Color.gold()
+    )
     
-    async def create_leaderboard_embed(self):
-        with sqlite3.connect(DB_PATH) as conn:
-            cur = conn.cursor()
-            cur.execute("""
-                SELECT user_id, balance 
-                FROM economy 
-                WHERE balance > 0 
-                ORDER BY balance DESC 
-                LIMIT 10 OFFSET ?
-            """, (self.current_page * 10,))
-            users = cur.fetchall()
-        
-        embed = discord.Embed(
-            title="Ball Leaderboard",
-            description="People with the most BALLS!",
-            color=discord.Color.gold()
-        )
-        
-        if not users:
-            embed.add_field(
-                name="No Data", 
-                value="No users found on this page.", 
-                inline=False
-            )
-            return embed
-        
-        leaderboard_text = ""
-        start_rank = self.current_page * 10 + 1
-        
-        for i, (user_id, balance) in enumerate(users):
-            rank = start_rank + i
-            
-            try:
-                user = await self.bot.fetch_user(user_id)
-                username = user.display_name
-            except:
-                username = f"Unknown User ({user_id})"
-            
-            if rank == 1:
-                medal = "🥇"
-            elif rank == 2:
-                medal = "🥈"
-            elif rank == 3:
-                medal = "🥉"
-            else:
-                medal = f"**{rank}.**"
-            
-            leaderboard_text += f"{medal} {username} - **{balance:,}** balls\n"
-        
+    if not users:
         embed.add_field(
-            name=f"Rankings {start_rank}-{start_rank + len(users) - 1}",
-            value=leaderboard_text,
+            name="No Data", 
+            value="No users found on this page.", 
             inline=False
         )
-        
-        embed.set_footer(text=f"Page {self.current_page + 1} of {self.total_pages}")
-        
         return embed
     
-    async def on_timeout(self):
-        for item in self.children:
-            item.disabled = True
+    leaderboard_text = ""
+    start_rank = users[0][0]
+    current_page = (start_rank - 1) // PAGE_SIZE
+    names = await directory.names(bot, [user_id for _, user_id, _ in users], guild)
+    
+    for rank, user_id, balance in users:
+        username = names[user_id]
+        
+        if rank == 1:
+            medal = "🥇"
+        elif rank == 2:
+            medal = "🥈"
+        elif rank == 3:
+            medal = "🥉"
+        else:
+            medal = f"**{rank}.**"
+        
+        leaderboard_text += f"{medal} {username} - **{balance:,}** balls\n"
+    
+    embed.add_field(
+        name=f"Rankings {start_rank}-{start_rank + len(users) - 1}",
+        value=leaderboard_text,
+        inline=False
+    )
+    
+    embed.set_footer(text=f"Page {current_page + 1} of {total_pages}")
+    embed.timestamp = store.ranks_at
+    
+    return embed
 
 def register_commands(bot):
     tree = bot.tree
+    # Ballflip and leaderboard components are dispatched by custom_id, so
+    # messages from before a restart keep working.
+    bot.add_dynamic_items(BallFlipChoice, LeaderboardButton)
 
+    @app_commands.guild_only()
     @tree.command(name="leaderboard", description="View the ball leaderboard")
     async def leaderboard(interaction: discord.Interaction):
-        with sqlite3.connect(DB_PATH) as conn:
-            cur = conn.cursor()
-            cur.execute("SELECT COUNT(*) FROM economy WHERE balance > 0")
-            total_users = cur.fetchone()[0]
+        store = economies.get(interaction.guild_id).store
+        total_users = await store.rank_total()
         
         if total_users == 0:
             embed = discord.Embed(
@@ -235,34 +224,65 @@ def register_commands(bot):
             await interaction.response.send_message(embed=embed)
             return
         
-        total_pages = (total_users + 9) // 10
+        total_pages = (total_users + PAGE_SIZE - 1) // PAGE_SIZE
         
-        view = LeaderboardView(bot, total_pages)
-        embed = await view.create_leaderboard_embed()
+        rows = await store.ranks_after(0, PAGE_SIZE)
+        view = leaderboard_view(rows, total_pages)
+        embed = await leaderboard_embed(bot, interaction.guild, store, rows, total_pages)
         
         await interaction.response.send_message(embed=embed, view=view)
 
+    @app_commands.guild_only()
+    @tree.command(name="rank", description="See where you are on the ball leaderboard")
+    @app_commands.describe(user="The user to look up")
+    async def rank(interaction: discord.Interaction, user: discord.Member = None):
+        target_user = user or interaction.user
+        store = economies.get(interaction.guild_id).store
+        row = await store.rank_of(target_user.id)
+        
+        if row is None:
+            description = f"{target_user.display_name} isn't on the leaderboard yet."
+        else:
+            position, balance = row
+            total = await store.rank_total()
+            description = f"{target_user.display_name} is **#{position:,}** of {total:,} with **{balance:,}** balls."
+        
+        embed = discord.Embed(
+            title="Leaderboard Rank",
+            description=description,
+            color=discord.Color.gold()
+        )
+        embed.set_footer(text=f"Ranks refresh every {int(LEADERBOARD_REFRESH)}s")
+        embed.timestamp = store.ranks_at
+        
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.guild_only()
     @tree.command(name="daily", description="Claim your daily balls :>")
     async def daily(interaction: discord.Interaction):
         user_id = interaction.user.id
-        balance, last_daily = get_user(user_id)
-
+        reward = random.randint(100, 500)
         now = datetime.datetime.utcnow()
-        if last_daily:
-            last_time = datetime.datetime.fromisoformat(last_daily)
-            if (now - last_time).total_seconds() < 86400:
-                next_claim = last_time + datetime.timedelta(days=1)
-                embed = discord.Embed(
-                    title="Too Early!",
-                    description=f"You already claimed your daily reward!\nCome back at `{next_claim.isoformat(timespec='minutes')}` UTC.",
-                    color=discord.Color.orange()
-                )
-                await interaction.response.send_message(embed=embed, ephemeral=True)
-                return
+        guild_economy = economies.get(interaction.guild_id)
+        retry = guild_economy.cooldowns.hit("daily", user_id)
+        if retry:
+            claimed, next_claim = False, now + datetime.timedelta(seconds=retry)
+        else:
+            claimed, new_balance, last_daily = await guild_economy.bank.claim_daily(user_id, reward, now, DAILY_COOLDOWN)
+            if not claimed:
+                # Claimed before the cooldowns were loaded.
+                next_claim = datetime.datetime.fromisoformat(last_daily) + DAILY_COOLDOWN
+                ready_at = next_claim.replace(tzinfo=datetime.timezone.utc).timestamp()
+                guild_economy.cooldowns.set("daily", user_id, ready_at)
 
-        reward = random.randint(100, 500)
-        new_balance = balance + reward
-        update_user(user_id, balance=new_balance, last_daily=now.isoformat())
+        if not claimed:
+            embed = discord.Embed(
+                title="Too Early!",
+                description=f"You already claimed your daily reward!\nCome back at `{next_claim.isoformat(timespec='minutes')}` UTC.",
+                color=discord.Color.orange()
+            )
+            await interaction.response.send_message(embed=embed, ephemeral=True)
+            return
 
         embed = discord.Embed(
             title="Daily Reward Claimed!",
@@ -274,10 +294,14 @@ def register_commands(bot):
         
         await interaction.response.send_message(embed=embed)
 
+    @app_commands.guild_only()
     @tree.command(name="ballflip", description="Bet on heads or tails")
     @app_commands.describe(bet="Amount to bet")
     async def ballflip(interaction: discord.Interaction, bet: int):
-        bal, _ = get_user(interaction.user.id)
+        if await throttled(interaction, "ballflip"):
+            return
+        bank = economies.get(interaction.guild_id).bank
+        bal, _ = await bank.get_user(interaction.user.id)
         
         if bet <= 0 or bet > bal:
             await interaction.response.send_message("Invalid bet amount.", ephemeral=True)
@@ -290,7 +314,7 @@ def register_commands(bot):
         )
         embed.add_field(name="Current Balance", value=f"**{bal}** balls", inline=False)
         
-        view = BallFlipView(bet, interaction.user.id)
+        view = ballflip_view(bet, interaction.user.id)
         
         try:
             await interaction.response.send_message(embed=embed, view=view)
@@ -300,6 +324,7 @@ def register_commands(bot):
             except:
                 print(f"Failed to send ballflip message for user {interaction.user.id}: {e}")
 
+    @app_commands.guild_only()
     @tree.command(name="rob", description="Rob another user")
     @app_commands.describe(victim="The user you want to rob")
     async def rob(interaction: discord.Interaction, victim: discord.Member):
@@ -312,24 +337,24 @@ def register_commands(bot):
             await interaction.response.send_message(embed=embed, ephemeral=True)
             return
 
-        thief_bal, _ = get_user(interaction.user.id)
-        victim_bal, _ = get_user(victim.id)
+        if await throttled(interaction, "rob"):
+            return
+        bank = economies.get(interaction.guild_id).bank
+        victim_bal, _ = await bank.get_user(victim.id)
 
         if victim_bal < 100:
-            embed = discord.Embed(
-                title="Target Too Poor!",
-                description=f"{victim.display_name} is too broke to be robbed dude.",
-                color=discord.Color.red()
-            )
-            await interaction.response.send_message(embed=embed, ephemeral=True)
+            await interaction.response.send_message(embed=too_poor_embed(victim), ephemeral=True)
             return
 
         success = random.random() < 0.5
-        stolen = random.randint(50, min(200, victim_bal)) if success else 0
 
         if success:
-            thief_bal += stolen
-            victim_bal -= stolen
+            stolen = random.randint(50, min(200, victim_bal))
+            balances = await bank.transfer(victim.id, interaction.user.id, stolen, kind="rob")
+            if balances is None:
+                await interaction.response.send_message(embed=too_poor_embed(victim), ephemeral=True)
+                return
+            thief_bal = balances[1]
             embed = discord.Embed(
                 title="Robbery Successful!",
                 description=f"You successfully robbed **{stolen}** balls from {victim.display_name}! (shame on u, but ok)",
@@ -337,7 +362,7 @@ def register_commands(bot):
             )
         else:
             fine = random.randint(20, 100)
-            thief_bal = max(0, thief_bal - fine)
+            thief_bal = await bank.credit(interaction.user.id, -fine, kind="rob_fine")
             embed = discord.Embed(
                 title="Caught Red-Handed!",
                 description=f"You got an insane skill issue, so you paid a fine of **{fine}** balls.",
@@ -346,16 +371,15 @@ def register_commands(bot):
         
         embed.add_field(name="Your New Balance", value=f"**{thief_bal}** balls", inline=False)
         
-        update_user(interaction.user.id, balance=thief_bal)
-        update_user(victim.id, balance=victim_bal)
-        
         await interaction.response.send_message(embed=embed)
 
+    @app_commands.guild_only()
     @tree.command(name="balls", description="Check someone's ball balance")
     @app_commands.describe(user="The user to check")
     async def balls(interaction: discord.Interaction, user: discord.Member = None):
         target_user = user or interaction.user
-        bal, _ = get_user(target_user.id)
+        bank = economies.get(interaction.guild_id).bank
+        bal, _ = await bank.get_user(target_user.id)
         
         if target_user.id == interaction.user.id:
             embed = discord.Embed(
@@ -372,4 +396,26 @@ def register_commands(bot):
         
         embed.set_thumbnail(url=target_user.display_avatar.url)
         
-        await interaction.response.send_message(embed=embed)
\ No newline at end of file
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.guild_only()
+    @tree.command(name="history", description="See recent ball transactions")
+    @app_commands.describe(user="The user to check")
+    async def history(interaction: discord.Interaction, user: discord.Member = None):
+        target_user = user or interaction.user
+        entries = await economies.get(interaction.guild_id).store.ledger.history(target_user.id, HISTORY_SIZE)
+
+        lines = []
+        for _, delta, balance, kind, counterparty, at in entries:
+            label = KIND_LABELS.get(kind, kind)
+            if counterparty:
+                label += f" <@{counterparty}>"
+            lines.append(f"<t:{int(at)}:R> {label}: **{delta:+}** → {balance}")
+
+        embed = discord.Embed(
+            title=f"{target_user.display_name}'s Transactions",
+            description="\n".join(lines) or "No transactions yet.",
+            color=discord.Color.blue()
+        )
+        embed.set_thumbnail(url=target_user.display_avatar.url)
+        await interaction.response.send_message(embed=embed, allowed_mentions=discord.AllowedMentions.none())
@@ -0,0 +1,280 @@
+import asyncio
+import datetime
+import glob
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+
+from server.balancecache import ECONOMY_WRITE_BEHIND, BalanceCache
+from server.ledger import LEDGER_ARCHIVE_DIR
+from server.storage import DB_PATH, EconomyStore
+from server.users import USERS_DB_PATH, init_users
+from utils.cooldowns import Cooldowns
+
+# One SQLite file per guild. A guild's events only ever arrive on the shard
+# that owns it, so when shards run as separate processes no two processes
+# write the same file.
+ECONOMY_DIR = os.path.join("data", "economy")
+# Economies untouched this long are flushed and closed, so a bot in many
+# quiet guilds doesn't keep a connection and DB thread open for each.
+ECONOMY_IDLE_CLOSE = float(os.getenv("ECONOMY_IDLE_CLOSE", "1800"))
+ECONOMY_SWEEP_INTERVAL = float(os.getenv("ECONOMY_SWEEP_INTERVAL", "300"))
+# Cooldowns at least this long are saved to the guild DB (on each sweep and
+# on close) and survive restarts; shorter ones only live in memory.
+COOLDOWN_PERSIST_MIN = float(os.getenv("COOLDOWN_PERSIST_MIN", "300"))
+MIGRATION_LOCK = os.path.join(ECONOMY_DIR, ".migrate.lock")
+MIGRATION_MARKER = os.path.join(ECONOMY_DIR, ".legacy-migrated")
+
+def guild_db_path(guild_id: int) -> str:
+    return os.path.join(ECONOMY_DIR, f"{guild_id}.db")
+
+class GuildEconomy:
+    # One guild's economy: its own DB file and ledger archive, balance
+    # cache, command cooldowns and leaderboard refresher.
+    def __init__(self, guild_id: int):
+        self.guild_id = guild_id
+        self.store = EconomyStore(guild_db_path(guild_id))
+        self.store.ledger.archive_dir = os.path.join(LEDGER_ARCHIVE_DIR, str(guild_id))
+        self.bank = BalanceCache(self.store) if ECONOMY_WRITE_BEHIND else self.store
+        self.cooldowns = Cooldowns(persist_min=COOLDOWN_PERSIST_MIN)
+        self.used_at = time.monotonic()
+        self._rank_task = None
+        self._load_task = None
+
+    async def load_cooldowns(self):
+        # Calls that come in before this finishes still reach the DB, which
+        # enforces /daily itself; every other limit is only a throttle.
+        now = time.time()
+        limit = self.cooldowns.limit("daily")
+        window = limit.per if limit else 0
+        cutoff = datetime.datetime.utcnow() - datetime.timedelta(seconds=window)
+        try:
+            saved, dailies = await self.store.load_cooldowns(now, cutoff)
+        except Exception as e:
+            print(f"Loading cooldowns for guild {self.guild_id} failed: {e}")
+            return
+        for command, user_id, full_at in saved:
+            self.cooldowns.set(command, user_id, full_at, now)
+        if limit is not None:
+            for user_id, last_daily in dailies:
+                claimed = datetime.datetime.fromisoformat(last_daily).replace(tzinfo=datetime.timezone.utc)
+                self.cooldowns.set("daily", user_id, claimed.timestamp() + window, now)
+
+    async def save_cooldowns(self):
+        rows = self.cooldowns.take_dirty()
+        if not rows:
+            return
+        try:
+            await self.store.save_cooldowns(rows, time.time())
+        except BaseException:
+            self.cooldowns.restore_dirty(rows)
+            raise
+
+    def start(self):
+        if self._rank_task is None:
+            self._rank_task = asyncio.create_task(self.store.rank_refresher())
+            self._load_task = asyncio.create_task(self.load_cooldowns())
+            self.store.ledger.start()
+            if isinstance(self.bank, BalanceCache):
+                self.bank.start()
+
+    async def close(self):
+        if self._rank_task is not None:
+            self._rank_task.cancel()
+            self._rank_task = None
+        if self._load_task is not None:
+            self._load_task.cancel()
+            self._load_task = None
+        await self.save_cooldowns()
+        if isinstance(self.bank, BalanceCache):
+            await self.bank.close()
+        await self.store.ledger.close()
+        await asyncio.to_thread(self.store.close)
+
+class GuildEconomies:
+    # Opens guild economies on first use. Handlers resolve the economy per
+    # interaction and don't hold on to it, so an idle one can be closed and
+    # simply reopened by the next command.
+    def __init__(self, idle_close: float = ECONOMY_IDLE_CLOSE):
+        self.idle_close = idle_close
+        self.counters = {"opened": 0, "closed": 0}
+        self._economies = {}
+        self._sweep_task = None
+
+    def get(self, guild_id: int) -> GuildEconomy:
+        economy = self._economies.get(guild_id)
+        if economy is None:
+            economy = self._economies[guild_id] = GuildEconomy(guild_id)
+            self.counters["opened"] += 1
+            if self._sweep_task is not None:
+                economy.start()
+        economy.used_at = time.monotonic()
+        return economy
+
+    def __iter__(self):
+        return iter(list(self._economies.values()))
+
+    async def sweep(self) -> int:
+        # Saves every economy's cooldowns and closes the idle ones.
+        cutoff = time.monotonic() - self.idle_close
+        idle = [economy for economy in self._economies.values() if economy.used_at < cutoff]
+        for economy in list(self._economies.values()):
+            if economy not in idle:
+                await economy.save_cooldowns()
+        for economy in idle:
+            del self._economies[economy.guild_id]
+            await economy.close()
+        self.counters["closed"] += len(idle)
+        return len(idle)
+
+    async def run(self, interval: float = ECONOMY_SWEEP_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.sweep()
+            except Exception as e:
+                print(f"Economy sweep failed, will retry: {e}")
+
+    def start(self):
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.create_task(self.run())
+            for economy in self._economies.values():
+                economy.start()
+
+    async def close(self):
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            self._sweep_task = None
+        economies, self._economies = list(self._economies.values()), {}
+        for economy in economies:
+            try:
+                await economy.close()
+            except Exception as e:
+                print(f"Failed to close economy for guild {economy.guild_id}: {e}")
+
+    def stats(self) -> dict:
+        return {**self.counters, "open": len(self._economies)}
+
+economies = GuildEconomies()
+
+class MigrationConflict(Exception):
+    pass
+
+def _has_economy(path: str) -> bool:
+    conn = sqlite3.connect(path)
+    try:
+        row = conn.execute(
+            "SELECT EXISTS (SELECT 1 FROM economy) OR EXISTS (SELECT 1 FROM grant_keys) OR EXISTS (SELECT 1 FROM ledger)"
+        ).fetchone()
+    except sqlite3.OperationalError:
+        return False
+    finally:
+        conn.close()
+    return bool(row[0])
+
+@contextmanager
+def _migration_lock():
+    # flock on POSIX. Windows has no fcntl, so lock the file's first byte
+    # with msvcrt instead (LK_LOCK gives up after ~10s, hence the loop).
+    with open(MIGRATION_LOCK, "a+") as lock:
+        try:
+            import fcntl
+        except ImportError:
+            import msvcrt
+            lock.seek(0)
+            while True:
+                try:
+                    msvcrt.locking(lock.fileno(), msvcrt.LK_LOCK, 1)
+                    break
+                except OSError:
+                    pass
+            try:
+                yield
+            finally:
+                lock.seek(0)
+                msvcrt.locking(lock.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            yield
+
+def migrate_legacy(guild_id: int, legacy_path: str = DB_PATH, users_path: str = USERS_DB_PATH) -> bool:
+    # The single-guild bot kept everything in data/economy.db. Its economy
+    # becomes `guild_id`'s, its ledger archives move under that guild, and
+    # saved user names go to the shared users DB. The legacy file is copied
+    # with the backup API (so a leftover WAL is included) and left as is; a
+    # marker file records that it was migrated.
+    #
+    # Runs under an exclusive lock, so processes starting together don't
+    # race. An empty guild file (opened before the migration) is replaced;
+    # one that already holds balances raises MigrationConflict rather than
+    # hiding the legacy balances behind it.
+    os.makedirs(ECONOMY_DIR, exist_ok=True)
+    target = guild_db_path(guild_id)
+    with _migration_lock():
+        if not os.path.exists(legacy_path) or os.path.exists(MIGRATION_MARKER):
+            return False
+        if os.path.exists(target):
+            if _has_economy(target):
+                raise MigrationConflict(
+                    f"{legacy_path} was never migrated, but {target} already has balances. Merge them by hand, "
+                    f"or create {MIGRATION_MARKER} if the legacy economy was already moved."
+                )
+            for suffix in ("", "-wal", "-shm"):
+                if os.path.exists(target + suffix):
+                    os.remove(target + suffix)
+
+        tmp = target + ".tmp"
+        src = sqlite3.connect(legacy_path)
+        try:
+            dst = sqlite3.connect(tmp)
+            try:
+                src.backup(dst)
+            finally:
+                dst.close()
+        finally:
+            src.close()
+
+        conn = sqlite3.connect(users_path, isolation_level=None)
+        try:
+            init_users(conn)
+            conn.execute("ATTACH DATABASE ? AS legacy", (tmp,))
+            has_names = conn.execute(
+                "SELECT 1 FROM legacy.sqlite_master WHERE type = 'table' AND name = 'user_names'"
+            ).fetchone()
+            if has_names:
+                conn.execute("INSERT OR IGNORE INTO user_names SELECT user_id, name, updated_at FROM legacy.user_names")
+            conn.execute("DETACH DATABASE legacy")
+        finally:
+            conn.close()
+
+        archives = glob.glob(os.path.join(LEDGER_ARCHIVE_DIR, "ledger-*.db"))
+        if archives:
+            guild_archive = os.path.join(LEDGER_ARCHIVE_DIR, str(guild_id))
+            os.makedirs(guild_archive, exist_ok=True)
+            for path in archives:
+                shutil.move(path, os.path.join(guild_archive, os.path.basename(path)))
+
+        os.replace(tmp, target)
+        with open(MIGRATION_MARKER, "w") as marker:
+            marker.write(f"{guild_id}\n")
+    return True
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+
+    parser = argparse.ArgumentParser(description="Move the single-guild data/economy.db to a guild's own file.")
+    parser.add_argument("guild", type=int, help="id of the guild the legacy economy belongs to")
+    parser.add_argument("--db", default=DB_PATH)
+    args = parser.parse_args()
+    try:
+        migrated = migrate_legacy(args.guild, args.db)
+    except MigrationConflict as e:
+        print(f"error: {e}", file=sys.stderr)
+        sys.exit(1)
+    if migrated:
+        print(f"Migrated {args.db} to {guild_db_path(args.guild)}")
+    else:
+        print(f"Nothing to migrate ({args.db} missing or already migrated)")
@@ -1,48 +1,249 @@
+import asyncio
+import os
 import discord
+from functools import lru_cache
 from io import BytesIO
-from PIL import Image, ImageDraw, ImageFont
-import aiohttp
+from PIL import Image, ImageDraw
+
+from utils.encoding import policy_for
+from utils.fonts import REGULAR, get_font, layout_text
+from utils.httpclient import http
+from utils.render import RenderQueueFull, engine
 
 CHANNEL_ID = 1263067254803796030 #lobby/lounge/general
 
-async def generate_welcome_image(member: discord.Member) -> BytesIO:
-    bg = Image.new("RGBA", (512, 200), "#000000")
+WELCOME_SIZE = (512, 200)
+AVATAR_SIZE = 100
+AVATAR_FETCH_SIZE = 128
+WELCOME_FONTS = ("arial.ttf",) + REGULAR
+WELCOME_POLICY = policy_for("welcome")
+
+JOIN_QUEUE_SIZE = int(os.getenv("JOIN_QUEUE_SIZE", "200"))
+JOIN_CONCURRENCY = int(os.getenv("JOIN_CONCURRENCY", "2"))
+JOIN_COALESCE_WINDOW = float(os.getenv("JOIN_COALESCE_WINDOW", "0"))
+JOIN_COALESCE_THRESHOLD = int(os.getenv("JOIN_COALESCE_THRESHOLD", "4"))
+
+COLLAGE_MAX = 24
+COLLAGE_COLUMNS = 6
+TILE_SIZE = (128, 150)
+TILE_AVATAR = 96
+COLLAGE_HEADER = 70
+
+@lru_cache(maxsize=1)
+def welcome_template():
+    bg = Image.new("RGBA", WELCOME_SIZE, "#000000")
+    draw = ImageDraw.Draw(bg)
+    size, text = layout_text("Welcome to The Coding Realm", WELCOME_FONTS, WELCOME_SIZE[0] - 166, 28, 16)
+    draw.text((150, 40), text, font=get_font(WELCOME_FONTS, size), fill="white")
+    return bg
+
+@lru_cache(maxsize=2)
+def avatar_mask(size: int = AVATAR_SIZE):
+    mask = Image.new("L", (size, size), 0)
+    ImageDraw.Draw(mask).ellipse((0, 0, size, size), fill=255)
+    return mask
+
+def render_welcome_image(avatar_data: bytes, name: str, user_id: int, policy=WELCOME_POLICY) -> bytes:
+    bg = welcome_template().copy()
     draw = ImageDraw.Draw(bg)
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(member.display_avatar.url) as resp:
-            avatar_data = await resp.read()
-    pfp = Image.open(BytesIO(avatar_data)).convert("RGBA").resize((100, 100))
+    pfp = Image.open(BytesIO(avatar_data)).convert("RGBA").resize((AVATAR_SIZE, AVATAR_SIZE), Image.LANCZOS)
+    bg.paste(pfp, (30, 50), avatar_mask())
 
-    mask = Image.new("L", (100, 100), 0)
-    ImageDraw.Draw(mask).ellipse((0, 0, 100, 100), fill=255)
-    bg.paste(pfp, (30, 50), mask)
+    font_small = get_font(WELCOME_FONTS, 18)
+    draw.text((150, 80), name, font=font_small, fill="white")
+    draw.text((150, 110), f"ID: {user_id}", font=font_small, fill="white")
+    return policy.encode(bg)
 
-    font_large = ImageFont.truetype("arial.ttf", 28)
-    font_small = ImageFont.truetype("arial.ttf", 18)
+def render_welcome_collage(avatars: list, names: list, policy=WELCOME_POLICY) -> bytes:
+    columns = min(len(names), COLLAGE_COLUMNS)
+    rows = (len(names) + columns - 1) // columns
+    width = max(columns * TILE_SIZE[0], WELCOME_SIZE[0])
+    bg = Image.new("RGBA", (width, COLLAGE_HEADER + rows * TILE_SIZE[1]), "#000000")
+    draw = ImageDraw.Draw(bg)
 
-    draw.text((150, 40), f"Welcome to The Coding Realm", font=font_large, fill="white")
-    draw.text((150, 80), f"{member.name}#{member.discriminator}", font=font_small, fill="white")
-    draw.text((150, 110), f"ID: {member.id}", font=font_small, fill="white")
+    size, text = layout_text("Welcome to The Coding Realm", WELCOME_FONTS, width - 40, 28, 16)
+    draw.text((20, 12), text, font=get_font(WELCOME_FONTS, size), fill="white")
+    draw.text((20, 44), f"{len(names)} new members", font=get_font(WELCOME_FONTS, 16), fill=(200, 200, 200))
 
-    output = BytesIO()
-    bg.save(output, format="PNG")
-    output.seek(0)
-    return output
+    mask = avatar_mask(TILE_AVATAR)
+    font_name = get_font(WELCOME_FONTS, 14)
+    x_pad = (width - columns * TILE_SIZE[0]) // 2
+    for i, (avatar_data, name) in enumerate(zip(avatars, names)):
+        x = x_pad + (i % columns) * TILE_SIZE[0]
+        y = COLLAGE_HEADER + (i // columns) * TILE_SIZE[1]
+        ax = x + (TILE_SIZE[0] - TILE_AVATAR) // 2
 
-async def handle_member_join(bot: discord.Client, member: discord.Member):
-    channel = bot.get_channel(CHANNEL_ID)
-    if not channel:
+        if avatar_data is not None:
+            pfp = Image.open(BytesIO(avatar_data)).convert("RGBA").resize((TILE_AVATAR, TILE_AVATAR), Image.LANCZOS)
+            bg.paste(pfp, (ax, y), mask)
+        else:
+            draw.ellipse((ax, y, ax + TILE_AVATAR, y + TILE_AVATAR), fill=(80, 80, 80))
+
+        _, label = layout_text(name, WELCOME_FONTS, TILE_SIZE[0] - 8, 14, 14)
+        label_w = font_name.getlength(label)
+        draw.text((x + (TILE_SIZE[0] - label_w) / 2, y + TILE_AVATAR + 8), label, font=font_name, fill="white")
+    return policy.encode(bg)
+
+async def fetch_avatar(member: discord.Member) -> bytes | None:
+    try:
+        return await http.get_bytes(member.display_avatar.with_size(AVATAR_FETCH_SIZE).url)
+    except Exception:
+        return None
+
+async def generate_welcome_image(member: discord.Member) -> BytesIO | None:
+    # None when the avatar can't be fetched; the welcome goes out without
+    # the card.
+    avatar_data = await fetch_avatar(member)
+    if avatar_data is None:
+        return None
+    data = await engine.submit(render_welcome_image, avatar_data, f"{member.name}#{member.discriminator}", member.id)
+    return BytesIO(data)
+
+def welcome_embed(member: discord.Member) -> discord.Embed:
+    return discord.Embed(
+        title="Welcome to The Coding Realm",
+        description=f"Hey {member.mention}, glad to have you with us!",
+        color=discord.Color.purple()
+    )
+
+async def send_welcome(channel, member: discord.Member):
+    embed = welcome_embed(member)
+    try:
+        image_bytes = await generate_welcome_image(member)
+    except RenderQueueFull:
+        image_bytes = None
+    if image_bytes is None:
+        await channel.send(embed=embed)
         return
 
-    image_bytes = await generate_welcome_image(member)
-    file = discord.File(image_bytes, filename="welcome.png")
+    filename = WELCOME_POLICY.filename("welcome")
+    file = discord.File(image_bytes, filename=filename)
+    embed.set_image(url=f"attachment://{filename}")
+    await channel.send(file=file, embed=embed)
 
+async def send_collage(channel, members: list):
     embed = discord.Embed(
         title="Welcome to The Coding Realm",
-        description=f"Hey {member.mention}, glad to have you with us!",
+        description=f"Hey {', '.join(m.mention for m in members)}, glad to have you all with us!",
         color=discord.Color.purple()
     )
-    embed.set_image(url="attachment://welcome.png")
+    avatars = await asyncio.gather(*(fetch_avatar(m) for m in members))
+    try:
+        data = await engine.submit(render_welcome_collage, list(avatars), [m.name for m in members])
+    except RenderQueueFull:
+        await channel.send(embed=embed)
+        return
 
+    filename = WELCOME_POLICY.filename("welcome")
+    file = discord.File(BytesIO(data), filename=filename)
+    embed.set_image(url=f"attachment://{filename}")
     await channel.send(file=file, embed=embed)
+
+class JoinQueue:
+    # Joins are queued and welcomed by a fixed number of workers, so a raid
+    # can't start hundreds of renders at once. When the queue is full the
+    # member still gets a welcome, just without the image.
+    #
+    # With a coalesce window, a single batcher collects the joins arriving
+    # within `window` seconds of the first one; from `threshold` members up
+    # they share one message with a collage, below it each gets their card.
+    def __init__(self, maxsize: int = JOIN_QUEUE_SIZE, concurrency: int = JOIN_CONCURRENCY,
+                 window: float = JOIN_COALESCE_WINDOW, threshold: int = JOIN_COALESCE_THRESHOLD):
+        self.maxsize = maxsize
+        self.concurrency = concurrency
+        self.window = window
+        self.threshold = threshold
+        self.bot = None
+        self._queue = None
+        self._workers = []
+
+    def start(self, bot: discord.Client):
+        self.bot = bot
+        self._queue = asyncio.Queue(self.maxsize)
+        if self.window > 0:
+            self._workers = [asyncio.create_task(self._batcher())]
+        else:
+            self._workers = [asyncio.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    @property
+    def running(self) -> bool:
+        return bool(self._workers)
+
+    def stop(self):
+        for task in self._workers:
+            task.cancel()
+        self._workers = []
+
+    def submit(self, member: discord.Member) -> bool:
+        try:
+            self._queue.put_nowait(member)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def _worker(self):
+        while True:
+            member = await self._queue.get()
+            try:
+                channel = self.bot.get_channel(CHANNEL_ID)
+                if channel:
+                    await send_welcome(channel, member)
+            except Exception as e:
+                print(f"Failed to welcome {member.id}: {e}")
+            finally:
+                self._queue.task_done()
+
+    async def _collect(self) -> list:
+        batch = [await self._queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.window
+        while len(batch) < COLLAGE_MAX:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _batcher(self):
+        slots = asyncio.Semaphore(self.concurrency)
+
+        async def welcome_one(channel, member):
+            async with slots:
+                await send_welcome(channel, member)
+
+        while True:
+            batch = await self._collect()
+            try:
+                channel = self.bot.get_channel(CHANNEL_ID)
+                if not channel:
+                    continue
+                if len(batch) >= self.threshold:
+                    await send_collage(channel, batch)
+                else:
+                    results = await asyncio.gather(*(welcome_one(channel, m) for m in batch), return_exceptions=True)
+                    for member, result in zip(batch, results):
+                        if isinstance(result, Exception):
+                            print(f"Failed to welcome {member.id}: {result}")
+            except Exception as e:
+                print(f"Failed to welcome {len(batch)} members: {e}")
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+join_queue = JoinQueue()
+
+async def handle_member_join(bot: discord.Client, member: discord.Member):
+    # The welcome channel belongs to one community; joins to other guilds
+    # aren't announced there.
+    channel = bot.get_channel(CHANNEL_ID)
+    if not channel or channel.guild.id != member.guild.id:
+        return
+
+    if not join_queue.running:
+        await send_welcome(channel, member)
+    elif not join_queue.submit(member):
+        await channel.send(embed=welcome_embed(member))
@@ -0,0 +1,219 @@
+import asyncio
+import datetime
+import os
+import time
+
+LEDGER_FLUSH_INTERVAL = float(os.getenv("LEDGER_FLUSH_INTERVAL", "2"))
+LEDGER_FLUSH_THRESHOLD = int(os.getenv("LEDGER_FLUSH_THRESHOLD", "500"))
+LEDGER_RETENTION_DAYS = float(os.getenv("LEDGER_RETENTION_DAYS", "30"))
+LEDGER_COMPACT_INTERVAL = float(os.getenv("LEDGER_COMPACT_INTERVAL", "3600"))
+LEDGER_COMPACT_BATCH = int(os.getenv("LEDGER_COMPACT_BATCH", "50000"))
+LEDGER_ARCHIVE_DIR = os.path.join("data", "ledger_archive")
+
+INSERT_ENTRY = (
+    "INSERT INTO ledger (user_id, delta, balance, kind, counterparty, at) VALUES (?, ?, ?, ?, ?, ?)"
+)
+HISTORY = (
+    "SELECT id, delta, balance, kind, counterparty, at FROM ledger "
+    "WHERE user_id = ? ORDER BY id DESC LIMIT ?"
+)
+FOLD_BASE = (
+    "INSERT INTO ledger_base (user_id, balance, last_id) "
+    "SELECT user_id, balance, id FROM ledger WHERE id IN "
+    "(SELECT MAX(id) FROM ledger WHERE id <= ? GROUP BY user_id) "
+    "ON CONFLICT(user_id) DO UPDATE SET balance = excluded.balance, last_id = excluded.last_id"
+)
+# A user's balance according to the ledger: their latest entry, else the
+# compacted base, else 0.
+DRIFT = '''
+    SELECT user_id, balance, derived FROM (
+        SELECT e.user_id, e.balance, COALESCE(
+            (SELECT l.balance FROM ledger l WHERE l.user_id = e.user_id ORDER BY l.id DESC LIMIT 1),
+            (SELECT b.balance FROM ledger_base b WHERE b.user_id = e.user_id),
+            0
+        ) AS derived
+        FROM economy e
+    ) WHERE balance != derived
+'''
+
+def init_ledger(conn):
+    fresh = conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'ledger_base'").fetchone() is None
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ledger (
+            id INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            balance INTEGER NOT NULL,
+            kind TEXT NOT NULL,
+            counterparty INTEGER,
+            at REAL NOT NULL
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ledger_user ON ledger (user_id, id)")
+    # Balances as of each user's last compacted entry.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS ledger_base (
+            user_id INTEGER PRIMARY KEY,
+            balance INTEGER NOT NULL,
+            last_id INTEGER NOT NULL
+        )
+    ''')
+    if fresh:
+        # Balances from before the ledger existed become the opening base.
+        conn.execute("INSERT OR IGNORE INTO ledger_base (user_id, balance, last_id) SELECT user_id, balance, 0 FROM economy")
+
+def _insert_entries(conn, rows):
+    conn.execute("BEGIN")
+    try:
+        conn.executemany(INSERT_ENTRY, rows)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+def _history(conn, user_id, limit):
+    return conn.execute(HISTORY, (user_id, limit)).fetchall()
+
+def _drift(conn):
+    return conn.execute(DRIFT).fetchall()
+
+def _compact(conn, cutoff, batch, archive_dir):
+    # Folds the oldest `batch` entries older than `cutoff` into ledger_base
+    # and moves them to one archive file per month.
+    row = conn.execute(
+        "SELECT MAX(id) FROM (SELECT id FROM ledger WHERE at < ? ORDER BY id LIMIT ?)", (cutoff, batch)
+    ).fetchone()
+    last_id = row[0]
+    if last_id is None:
+        return 0
+
+    months = [m for (m,) in conn.execute(
+        "SELECT DISTINCT strftime('%Y-%m', at, 'unixepoch') FROM ledger WHERE id <= ?", (last_id,)
+    )]
+    os.makedirs(archive_dir, exist_ok=True)
+    attached = []
+    try:
+        for i, month in enumerate(months):
+            name = f"archive{i}"
+            conn.execute("ATTACH DATABASE ? AS " + name, (os.path.join(archive_dir, f"ledger-{month}.db"),))
+            attached.append((name, month))
+            conn.execute(f'''
+                CREATE TABLE IF NOT EXISTS {name}.ledger (
+                    id INTEGER PRIMARY KEY,
+                    user_id INTEGER NOT NULL,
+                    delta INTEGER NOT NULL,
+                    balance INTEGER NOT NULL,
+                    kind TEXT NOT NULL,
+                    counterparty INTEGER,
+                    at REAL NOT NULL
+                )
+            ''')
+            conn.execute(f"CREATE INDEX IF NOT EXISTS {name}.idx_ledger_user ON ledger (user_id, id)")
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(FOLD_BASE, (last_id,))
+            # Archives commit separately from the main file in WAL mode;
+            # OR IGNORE makes a retry after a partial commit harmless.
+            for name, month in attached:
+                conn.execute(
+                    f"INSERT OR IGNORE INTO {name}.ledger SELECT * FROM main.ledger "
+                    "WHERE id <= ? AND strftime('%Y-%m', at, 'unixepoch') = ?",
+                    (last_id, month),
+                )
+            moved = conn.execute("DELETE FROM main.ledger WHERE id <= ?", (last_id,)).rowcount
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+    finally:
+        for name, _ in attached:
+            conn.execute("DETACH DATABASE " + name)
+    return moved
+
+class Ledger:
+    # Append-only record of every balance change. Entries are buffered and
+    # written in batches on the economy DB thread, so recording costs the
+    # command nothing beyond a list append. A crash loses at most the
+    # entries since the last flush.
+    def __init__(self, db, interval: float = LEDGER_FLUSH_INTERVAL, threshold: int = LEDGER_FLUSH_THRESHOLD,
+                 archive_dir: str = LEDGER_ARCHIVE_DIR):
+        self.db = db
+        self.interval = interval
+        self.threshold = threshold
+        self.archive_dir = archive_dir
+        self.counters = {"recorded": 0, "flushes": 0, "archived": 0}
+        self.compacted_at = None
+        self._pending = []
+        self._flush_lock = asyncio.Lock()
+        self._flush_task = None
+        self._loop_task = None
+
+    def record(self, user_id: int, delta: int, balance: int, kind: str, counterparty: int | None = None):
+        self._pending.append((user_id, delta, balance, kind, counterparty, time.time()))
+        self.counters["recorded"] += 1
+        if len(self._pending) >= self.threshold and (self._flush_task is None or self._flush_task.done()):
+            self._flush_task = asyncio.ensure_future(self.flush())
+
+    async def flush(self) -> int:
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+            rows, self._pending = self._pending, []
+            try:
+                await self.db.run(_insert_entries, rows)
+            except BaseException:
+                self._pending[:0] = rows
+                raise
+            self.counters["flushes"] += 1
+            return len(rows)
+
+    async def history(self, user_id: int, limit: int = 20):
+        await self.flush()
+        return await self.db.run(_history, user_id, limit)
+
+    async def drift(self):
+        # (user_id, balance, ledger balance) for every user whose stored
+        # balance disagrees with the ledger.
+        await self.flush()
+        return await self.db.run(_drift)
+
+    async def compact(self, retention_days: float = LEDGER_RETENTION_DAYS, batch: int = LEDGER_COMPACT_BATCH) -> int:
+        await self.flush()
+        cutoff = time.time() - retention_days * 86400
+        total = 0
+        while True:
+            moved = await self.db.run(_compact, cutoff, batch, self.archive_dir)
+            total += moved
+            if moved < batch:
+                break
+        self.counters["archived"] += total
+        self.compacted_at = datetime.datetime.now(datetime.timezone.utc)
+        return total
+
+    async def run(self, compact_interval: float = LEDGER_COMPACT_INTERVAL):
+        next_compact = time.monotonic() + compact_interval
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.flush()
+                if time.monotonic() >= next_compact:
+                    next_compact = time.monotonic() + compact_interval
+                    archived = await self.compact()
+                    if archived:
+                        print(f"Ledger: archived {archived} entries")
+            except Exception as e:
+                print(f"Ledger flush/compaction failed, will retry: {e}")
+
+    def start(self):
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self.run())
+
+    async def close(self):
+        if self._loop_task is not None:
+            self._loop_task.cancel()
+            self._loop_task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        return {**self.counters, "pending": len(self._pending)}
@@ -0,0 +1,335 @@
+import asyncio
+import datetime
+import os
+from contextlib import asynccontextmanager
+
+from server.ledger import Ledger, init_ledger
+from utils.dbthread import SQLiteThread
+
+# The single-guild economy; each guild now has its own file (server/guilds.py).
+DB_PATH = os.path.join("data", "economy.db")
+LOCK_STRIPES = 64
+LEADERBOARD_REFRESH = float(os.getenv("LEADERBOARD_REFRESH", "60"))
+# Rows copied per DB call while rebuilding the leaderboard, so commands
+# queued on the economy thread wait for one chunk rather than the lot.
+RANK_REBUILD_CHUNK = int(os.getenv("RANK_REBUILD_CHUNK", "5000"))
+
+# Statements are module constants so sqlite3's statement cache reuses the
+# prepared form on the long-lived connection.
+SELECT_USER = "SELECT balance, last_daily FROM economy WHERE user_id = ?"
+INSERT_USER = "INSERT OR IGNORE INTO economy (user_id, balance, last_daily) VALUES (?, 0, NULL)"
+CREDIT = (
+    "INSERT INTO economy (user_id, balance, last_daily) VALUES (?, MAX(0, ?), NULL) "
+    "ON CONFLICT(user_id) DO UPDATE SET balance = MAX(0, balance + ?) RETURNING balance"
+)
+DEBIT_IF_SUFFICIENT = (
+    "UPDATE economy SET balance = balance - ? + ? "
+    "WHERE user_id = ? AND balance >= ? RETURNING balance"
+)
+CLAIM_DAILY = (
+    "INSERT INTO economy (user_id, balance, last_daily) VALUES (?, ?, ?) "
+    "ON CONFLICT(user_id) DO UPDATE SET balance = balance + excluded.balance, last_daily = excluded.last_daily "
+    "WHERE last_daily IS NULL OR last_daily <= ? RETURNING balance, last_daily"
+)
+APPLY_DELTA = (
+    "INSERT INTO economy (user_id, balance, last_daily) VALUES (?, MAX(0, ?), ?) "
+    "ON CONFLICT(user_id) DO UPDATE SET balance = MAX(0, balance + ?), "
+    "last_daily = COALESCE(excluded.last_daily, last_daily)"
+)
+CREATE_NEXT_RANKS = '''
+    CREATE TABLE leaderboard_next (
+        rank INTEGER PRIMARY KEY,
+        user_id INTEGER NOT NULL UNIQUE,
+        balance INTEGER NOT NULL
+    )
+'''
+# Keyset scan down idx_economy_balance from the last (balance, user_id) copied.
+SCAN_RANKS = (
+    "SELECT user_id, balance FROM economy WHERE balance > 0 AND balance <= ? AND (balance < ? OR user_id > ?) "
+    "ORDER BY balance DESC, user_id LIMIT ?"
+)
+INSERT_NEXT_RANK = "INSERT OR IGNORE INTO leaderboard_next (user_id, balance) VALUES (?, ?)"
+RANK_TOTAL = "SELECT COALESCE(MAX(rank), 0) FROM leaderboard"
+RANKS_AFTER = "SELECT rank, user_id, balance FROM leaderboard WHERE rank > ? ORDER BY rank LIMIT ?"
+RANKS_BEFORE = "SELECT rank, user_id, balance FROM leaderboard WHERE rank < ? ORDER BY rank DESC LIMIT ?"
+RANK_OF = "SELECT rank, balance FROM leaderboard WHERE user_id = ?"
+SAVE_COOLDOWN = "INSERT OR REPLACE INTO cooldowns (command, user_id, full_at) VALUES (?, ?, ?)"
+
+def init_db(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS economy (
+            user_id INTEGER PRIMARY KEY,
+            balance INTEGER DEFAULT 0,
+            last_daily TEXT
+        )
+    ''')
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_economy_balance ON economy (balance DESC, user_id)")
+    # Materialized ranking: rank is the rowid, so pages and rank lookups
+    # are index seeks however many users there are.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS leaderboard (
+            rank INTEGER PRIMARY KEY,
+            user_id INTEGER NOT NULL UNIQUE,
+            balance INTEGER NOT NULL
+        )
+    ''')
+    # One row per applied bulk grant (see server/db_inject.py), so a payout
+    # file can be re-run without paying anyone twice.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS grant_keys (
+            key TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL,
+            delta INTEGER NOT NULL,
+            applied_at REAL NOT NULL
+        )
+    ''')
+
+    # Long command cooldowns (see utils/cooldowns.py), written back lazily.
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS cooldowns (
+            command TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            full_at REAL NOT NULL,
+            PRIMARY KEY (command, user_id)
+        ) WITHOUT ROWID
+    ''')
+
+    init_ledger(conn)
+
+def _get_user(conn, user_id):
+    row = conn.execute(SELECT_USER, (user_id,)).fetchone()
+    if not row:
+        conn.execute(INSERT_USER, (user_id,))
+        return 0, None
+    return row
+
+def _credit(conn, user_id, amount):
+    # Returns the balances before and after; CREDIT clamps at 0, so the
+    # change can be smaller than `amount`.
+    row = conn.execute(SELECT_USER, (user_id,)).fetchone()
+    balance = conn.execute(CREDIT, (user_id, amount, amount)).fetchone()[0]
+    return (row[0] if row else 0), balance
+
+def _debit_if_sufficient(conn, user_id, amount, payout):
+    row = conn.execute(DEBIT_IF_SUFFICIENT, (amount, payout, user_id, amount)).fetchone()
+    return row[0] if row else None
+
+def _transfer(conn, src, dst, amount):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        row = conn.execute(DEBIT_IF_SUFFICIENT, (amount, 0, src, amount)).fetchone()
+        if row is None:
+            conn.execute("ROLLBACK")
+            return None
+        dst_balance = conn.execute(CREDIT, (dst, amount, amount)).fetchone()[0]
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return row[0], dst_balance
+
+def _claim_daily(conn, user_id, reward, now, cutoff):
+    row = conn.execute(CLAIM_DAILY, (user_id, reward, now, cutoff)).fetchone()
+    if row is not None:
+        return True, row[0], row[1]
+    balance, last_daily = conn.execute(SELECT_USER, (user_id,)).fetchone()
+    return False, balance, last_daily
+
+def _apply_deltas(conn, rows):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.executemany(APPLY_DELTA, ((user_id, delta, last_daily, delta) for user_id, delta, last_daily in rows))
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+def _start_ranks(conn):
+    conn.execute("DROP TABLE IF EXISTS leaderboard_next")
+    conn.execute(CREATE_NEXT_RANKS)
+
+def _fill_ranks(conn, cursor, limit):
+    # Copies the next `limit` users after `cursor` into leaderboard_next;
+    # returns the new cursor, or None when the scan is done.
+    balance, user_id = cursor
+    rows = conn.execute(SCAN_RANKS, (balance, balance, user_id, limit)).fetchall()
+    conn.execute("BEGIN")
+    try:
+        conn.executemany(INSERT_NEXT_RANK, rows)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    if len(rows) < limit:
+        return None
+    user_id, balance = rows[-1]
+    return balance, user_id
+
+def _swap_ranks(conn):
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        conn.execute("DROP TABLE leaderboard")
+        conn.execute("ALTER TABLE leaderboard_next RENAME TO leaderboard")
+        total = conn.execute(RANK_TOTAL).fetchone()[0]
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    return total
+
+def _rank_total(conn):
+    return conn.execute(RANK_TOTAL).fetchone()[0]
+
+def _ranks_after(conn, rank, limit):
+    return conn.execute(RANKS_AFTER, (rank, limit)).fetchall()
+
+def _ranks_before(conn, rank, limit):
+    return conn.execute(RANKS_BEFORE, (rank, limit)).fetchall()[::-1]
+
+def _rank_of(conn, user_id):
+    return conn.execute(RANK_OF, (user_id,)).fetchone()
+
+def _load_cooldowns(conn, now, daily_cutoff):
+    saved = conn.execute("SELECT command, user_id, full_at FROM cooldowns WHERE full_at > ?", (now,)).fetchall()
+    dailies = conn.execute(
+        "SELECT user_id, last_daily FROM economy WHERE last_daily > ?", (daily_cutoff,)
+    ).fetchall()
+    return saved, dailies
+
+def _save_cooldowns(conn, rows, now):
+    conn.execute("BEGIN")
+    try:
+        conn.execute("DELETE FROM cooldowns WHERE full_at <= ?", (now,))
+        conn.executemany(SAVE_COOLDOWN, rows)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+class EconomyStore:
+    # All economy SQL runs on one dedicated thread holding a single WAL-mode
+    # connection; command handlers only await the results. Every change is
+    # also recorded in the ledger, with the balance it left behind.
+    def __init__(self, path: str = DB_PATH):
+        self.path = path
+        self.db = SQLiteThread(path, init=init_db, name="economy-db")
+        self.ledger = Ledger(self.db)
+        self._locks = [asyncio.Lock() for _ in range(LOCK_STRIPES)]
+        self._ranks_lock = asyncio.Lock()
+        self.ranks_dirty = True
+        self.ranks_at = None
+
+    @asynccontextmanager
+    async def locked(self, *user_ids):
+        # Operations on independent users take different stripes; stripes
+        # are acquired in index order so a transfer can't deadlock.
+        held = []
+        try:
+            for stripe in sorted({user_id % LOCK_STRIPES for user_id in user_ids}):
+                await self._locks[stripe].acquire()
+                held.append(self._locks[stripe])
+            yield
+        finally:
+            for lock in reversed(held):
+                lock.release()
+
+    async def get_user(self, user_id: int):
+        return await self.db.run(_get_user, user_id)
+
+    async def credit(self, user_id: int, amount: int, kind: str = "adjust") -> int:
+        async with self.locked(user_id):
+            self.ranks_dirty = True
+            before, balance = await self.db.run(_credit, user_id, amount)
+            self.ledger.record(user_id, balance - before, balance, kind)
+            return balance
+
+    async def debit_if_sufficient(self, user_id: int, amount: int, payout: int = 0, kind: str = "adjust") -> int | None:
+        # Takes `amount` and pays back `payout` in one statement, only if the
+        # balance covers `amount`. Returns the new balance, or None.
+        async with self.locked(user_id):
+            self.ranks_dirty = True
+            balance = await self.db.run(_debit_if_sufficient, user_id, amount, payout)
+            if balance is not None:
+                self.ledger.record(user_id, payout - amount, balance, kind)
+            return balance
+
+    async def transfer(self, src: int, dst: int, amount: int, kind: str = "transfer"):
+        async with self.locked(src, dst):
+            self.ranks_dirty = True
+            balances = await self.db.run(_transfer, src, dst, amount)
+            if balances is not None:
+                self.ledger.record(src, -amount, balances[0], kind, dst)
+                self.ledger.record(dst, amount, balances[1], kind, src)
+            return balances
+
+    async def claim_daily(self, user_id: int, reward: int, now: datetime.datetime, cooldown: datetime.timedelta):
+        cutoff = (now - cooldown).isoformat()
+        async with self.locked(user_id):
+            self.ranks_dirty = True
+            result = await self.db.run(_claim_daily, user_id, reward, now.isoformat(), cutoff)
+            if result[0]:
+                self.ledger.record(user_id, reward, result[1], "daily")
+            return result
+
+    async def apply_deltas(self, rows):
+        # Batched write-back: (user_id, balance delta, last_daily or None)
+        # rows applied in one transaction. Not recorded in the ledger; the
+        # caller records each change when it makes it.
+        if rows:
+            self.ranks_dirty = True
+            await self.db.run(_apply_deltas, list(rows))
+
+    async def refresh_ranks(self, force: bool = False, chunk: int = RANK_REBUILD_CHUNK) -> bool:
+        # Builds the new ranking in a shadow table a chunk per DB call, then
+        # swaps it in. Balances that change mid-scan can make a user miss
+        # this snapshot (or keep their first position); the next refresh
+        # picks them up.
+        async with self._ranks_lock:
+            if not (force or self.ranks_dirty):
+                return False
+            self.ranks_dirty = False
+            try:
+                await self.db.run(_start_ranks)
+                cursor = (2**63 - 1, 0)
+                while cursor is not None:
+                    cursor = await self.db.run(_fill_ranks, cursor, chunk)
+                await self.db.run(_swap_ranks)
+            except BaseException:
+                self.ranks_dirty = True
+                raise
+            self.ranks_at = datetime.datetime.now(datetime.timezone.utc)
+            return True
+
+    async def rank_refresher(self, interval: float = LEADERBOARD_REFRESH):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.refresh_ranks()
+            except Exception as e:
+                print(f"Leaderboard refresh failed: {e}")
+
+    async def rank_total(self) -> int:
+        if self.ranks_at is None:
+            await self.refresh_ranks(force=True)
+        return await self.db.run(_rank_total)
+
+    async def ranks_after(self, rank: int, limit: int = 10):
+        return await self.db.run(_ranks_after, rank, limit)
+
+    async def ranks_before(self, rank: int, limit: int = 10):
+        return await self.db.run(_ranks_before, rank, limit)
+
+    async def rank_of(self, user_id: int):
+        if self.ranks_at is None:
+            await self.refresh_ranks(force=True)
+        return await self.db.run(_rank_of, user_id)
+
+    async def load_cooldowns(self, now: float, daily_cutoff: datetime.datetime):
+        # Saved cooldowns, plus (user_id, last_daily) for recent /daily claims.
+        return await self.db.run(_load_cooldowns, now, daily_cutoff.isoformat())
+
+    async def save_cooldowns(self, rows, now: float):
+        await self.db.run(_save_cooldowns, list(rows), now)
+
+    def close(self):
+        self.db.close()
@@ -0,0 +1,144 @@
+import asyncio
+import os
+import time
+
+import discord
+
+from utils.dbthread import SQLiteThread
+
+# Names are per user, not per guild, so they live in one shared file
+# rather than in each guild's economy DB. Unlike the economy files, it is
+# written by every shard process. The writes are small cache upserts that
+# wait on each other (see SQLITE_BUSY_TIMEOUT_MS), and splitting the file
+# per process would mean each shard resolves the same names again.
+USERS_DB_PATH = os.path.join("data", "users.db")
+USER_CACHE_TTL = float(os.getenv("USER_CACHE_TTL", "3600"))
+USER_PERSIST_TTL = float(os.getenv("USER_PERSIST_TTL", str(7 * 86400)))
+USER_MISS_TTL = float(os.getenv("USER_MISS_TTL", "300"))
+USER_FETCH_CONCURRENCY = int(os.getenv("USER_FETCH_CONCURRENCY", "4"))
+
+SAVE_NAME = (
+    "INSERT INTO user_names (user_id, name, updated_at) VALUES (?, ?, ?) "
+    "ON CONFLICT(user_id) DO UPDATE SET name = excluded.name, updated_at = excluded.updated_at"
+)
+
+def init_users(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS user_names (
+            user_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            updated_at REAL NOT NULL
+        )
+    ''')
+
+def _load_names(conn, user_ids, since):
+    marks = ",".join("?" * len(user_ids))
+    sql = f"SELECT user_id, name, updated_at FROM user_names WHERE updated_at >= ? AND user_id IN ({marks})"
+    return conn.execute(sql, (since, *user_ids)).fetchall()
+
+def _save_names(conn, rows):
+    conn.execute("BEGIN")
+    try:
+        conn.executemany(SAVE_NAME, rows)
+        conn.execute("COMMIT")
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+
+class UserDirectory:
+    # Display names for user ids, in order of cost: in-memory TTL cache,
+    # the gateway member/user cache, names persisted in users.db, and
+    # finally REST lookups run concurrently with bounded parallelism.
+    def __init__(self, ttl: float = USER_CACHE_TTL, concurrency: int = USER_FETCH_CONCURRENCY,
+                 path: str = USERS_DB_PATH):
+        self.db = SQLiteThread(path, init=init_users, name="users-db")
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self.counters = {"cache_hits": 0, "gateway_hits": 0, "db_hits": 0, "fetches": 0, "misses": 0}
+        self._names = {}
+        self._fetch_slots = None
+
+    def _remember(self, key, name, ttl):
+        self._names[key] = (name, time.monotonic() + ttl)
+
+    def _cached(self, key, now):
+        cached = self._names.get(key)
+        if cached is not None and cached[1] > now:
+            self.counters["cache_hits"] += 1
+            return cached[0]
+        return None
+
+    async def names(self, bot, user_ids, guild=None) -> dict:
+        # A member's display name is their nickname in that guild, so it is
+        # cached under (guild id, user id). Everything else is the user's
+        # global name, cached under the user id and persisted.
+        now = time.monotonic()
+        result = {}
+        missing = []
+        for user_id in user_ids:
+            if guild is not None:
+                name = self._cached((guild.id, user_id), now)
+                if name is None:
+                    member = guild.get_member(user_id)
+                    if member is not None:
+                        self.counters["gateway_hits"] += 1
+                        name = member.display_name
+                        self._remember((guild.id, user_id), name, self.ttl)
+                if name is not None:
+                    result[user_id] = name
+                    continue
+
+            name = self._cached(user_id, now)
+            if name is None:
+                user = bot.get_user(user_id)
+                if user is not None:
+                    self.counters["gateway_hits"] += 1
+                    name = user.global_name or user.name
+                    self._remember(user_id, name, self.ttl)
+            if name is not None:
+                result[user_id] = name
+            else:
+                missing.append(user_id)
+
+        if missing:
+            for user_id, name, _ in await self.db.run(_load_names, missing, time.time() - USER_PERSIST_TTL):
+                self.counters["db_hits"] += 1
+                result[user_id] = name
+                self._remember(user_id, name, self.ttl)
+
+        missing = [user_id for user_id in missing if user_id not in result]
+        if missing:
+            fetched = await asyncio.gather(*(self._fetch(bot, user_id) for user_id in missing))
+            saved = []
+            for user_id, name in zip(missing, fetched):
+                if name is None:
+                    self.counters["misses"] += 1
+                    name = f"Unknown User ({user_id})"
+                    self._remember(user_id, name, USER_MISS_TTL)
+                else:
+                    self._remember(user_id, name, self.ttl)
+                    saved.append((user_id, name, time.time()))
+                result[user_id] = name
+            if saved:
+                await self.db.run(_save_names, saved)
+
+        return result
+
+    async def _fetch(self, bot, user_id):
+        if self._fetch_slots is None:
+            self._fetch_slots = asyncio.Semaphore(self.concurrency)
+        async with self._fetch_slots:
+            self.counters["fetches"] += 1
+            try:
+                user = await bot.fetch_user(user_id)
+            except discord.HTTPException:
+                return None
+            return user.global_name or user.name
+
+    def stats(self) -> dict:
+        return {**self.counters, "cached": len(self._names)}
+
+    def close(self):
+        self.db.close()
+
+directory = UserDirectory()
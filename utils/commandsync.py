@@ -0,0 +1,49 @@
+import hashlib
+import json
+import os
+
+import discord
+
+SYNC_STATE_PATH = os.path.join("data", "command_tree.json")
+
+def payload_hash(tree: discord.app_commands.CommandTree, guild: discord.abc.Snowflake | None = None) -> str:
+    payload = sorted(
+        (command.to_dict(tree) for command in tree.get_commands(guild=guild)),
+        key=lambda command: (command.get("type", 1), command["name"]),
+    )
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+def _load(path: str) -> dict:
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def _save(path: str, state: dict):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = path + ".tmp"
+    with open(tmp, "w") as f:
+        json.dump(state, f, indent=2, sort_keys=True)
+    os.replace(tmp, path)
+
+async def sync_if_changed(tree: discord.app_commands.CommandTree, guilds=(), force: bool = False,
+                          path: str = SYNC_STATE_PATH) -> list:
+    # Syncs each scope (global, then every guild given) only when its
+    # payload differs from what was last synced for this application.
+    # Returns the scopes that were synced.
+    state = _load(path)
+    app_id = str(tree.client.application_id)
+    known = state.setdefault(app_id, {})
+    synced = []
+
+    for guild in (None, *guilds):
+        scope = "global" if guild is None else str(guild.id)
+        digest = payload_hash(tree, guild)
+        if not force and known.get(scope) == digest:
+            continue
+        await tree.sync(guild=guild)
+        known[scope] = digest
+        _save(path, state)
+        synced.append(scope)
+    return synced
@@ -0,0 +1,131 @@
+import os
+import time
+
+from utils.metrics import metrics
+
+# Limits are "<uses>/<seconds>" token buckets: `uses` calls in a burst,
+# refilling one every seconds/uses. "off" disables a command's limit.
+# COOLDOWN_<COMMAND> (e.g. COOLDOWN_ROB=1/120) overrides the default.
+COOLDOWN_DEFAULT = os.getenv("COOLDOWN_DEFAULT", "5/30")
+DEFAULT_LIMITS = {
+    "daily": "1/86400",
+    "rob": "1/60",
+    "ballflip": "10/60",
+    "sp": "3/30",
+    "lyrics": "3/30",
+}
+COOLDOWN_SWEEP_INTERVAL = float(os.getenv("COOLDOWN_SWEEP_INTERVAL", "60"))
+
+class Limit:
+    __slots__ = ("uses", "per", "interval")
+
+    def __init__(self, uses: int, per: float):
+        if uses < 1 or per <= 0:
+            raise ValueError(f"bad limit {uses}/{per}")
+        self.uses = uses
+        self.per = per
+        self.interval = per / uses
+
+    @classmethod
+    def parse(cls, spec: str) -> "Limit | None":
+        spec = spec.strip().lower()
+        if spec in ("off", "0", ""):
+            return None
+        uses, _, per = spec.partition("/")
+        return cls(int(uses), float(per))
+
+def limit_for(command: str) -> Limit | None:
+    default = DEFAULT_LIMITS.get(command, COOLDOWN_DEFAULT)
+    spec = os.getenv(f"COOLDOWN_{command.upper()}", default)
+    try:
+        return Limit.parse(spec)
+    except ValueError as e:
+        print(f"Bad cooldown for {command} ({spec}), using {default}: {e}")
+        return Limit.parse(default)
+
+class Cooldowns:
+    # Token buckets per (command, key), stored GCRA-style: one float per key,
+    # the wall-clock time its bucket is full again. A missing key is a full
+    # bucket, so keys that have refilled are swept out as calls come in.
+    # Buckets for limits of at least `persist_min` seconds are marked dirty
+    # so the owner can write them back (see server/guilds.py).
+    def __init__(self, persist_min: float | None = None, sweep_interval: float = COOLDOWN_SWEEP_INTERVAL):
+        self.persist_min = persist_min
+        self.sweep_interval = sweep_interval
+        self.counters = {"allowed": 0, "rejected": 0, "swept": 0}
+        self._limits = {}
+        self._buckets = {}
+        self._dirty = set()
+        self._next_sweep = 0.0
+
+    def limit(self, command: str) -> Limit | None:
+        if command not in self._limits:
+            self._limits[command] = limit_for(command)
+        return self._limits[command]
+
+    def _persisted(self, limit) -> bool:
+        return self.persist_min is not None and limit.per >= self.persist_min
+
+    def hit(self, command: str, key: int, now: float | None = None) -> float:
+        # Takes a token. Returns 0 if the call may go ahead, else the seconds
+        # until it may.
+        limit = self.limit(command)
+        if limit is None:
+            return 0.0
+        now = time.time() if now is None else now
+        if now >= self._next_sweep:
+            self.sweep(now)
+
+        buckets = self._buckets.setdefault(command, {})
+        full_at = max(buckets.get(key, now), now) + limit.interval
+        if full_at - now > limit.per:
+            self.counters["rejected"] += 1
+            metrics.inc("cooldown_rejections_total", command=command)
+            return full_at - limit.per - now
+        buckets[key] = full_at
+        self.counters["allowed"] += 1
+        if self._persisted(limit):
+            self._dirty.add((command, key))
+        return 0.0
+
+    def set(self, command: str, key: int, full_at: float, now: float | None = None):
+        # Sets when a bucket is full again, e.g. from saved state or the
+        # database's own record of the last use.
+        now = time.time() if now is None else now
+        buckets = self._buckets.setdefault(command, {})
+        if full_at > now:
+            buckets[key] = full_at
+        else:
+            buckets.pop(key, None)
+
+    def sweep(self, now: float | None = None) -> int:
+        now = time.time() if now is None else now
+        swept = 0
+        for command, buckets in self._buckets.items():
+            full = [key for key, full_at in buckets.items() if full_at <= now]
+            for key in full:
+                del buckets[key]
+            swept += len(full)
+        self._next_sweep = now + self.sweep_interval
+        self.counters["swept"] += swept
+        return swept
+
+    def take_dirty(self) -> list:
+        # (command, key, full_at) for persisted buckets changed since the
+        # last call.
+        dirty, self._dirty = self._dirty, set()
+        rows = []
+        for command, key in dirty:
+            full_at = self._buckets.get(command, {}).get(key)
+            if full_at is not None:
+                rows.append((command, key, full_at))
+        return rows
+
+    def restore_dirty(self, rows):
+        self._dirty.update((command, key) for command, key, _ in rows)
+
+    def stats(self) -> dict:
+        return {**self.counters, "tracked": sum(len(b) for b in self._buckets.values()), "dirty": len(self._dirty)}
+
+# Limits for commands that don't belong to a guild economy.
+cooldowns = Cooldowns()
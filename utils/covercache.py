@@ -0,0 +1,125 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+
+from utils.httpclient import http
+
+COVER_DIR = os.path.join("data", "covers")
+COVER_MEMORY_BYTES = int(os.getenv("COVER_MEMORY_BYTES", str(64 * 1024 * 1024)))
+COVER_DISK_FILES = int(os.getenv("COVER_DISK_FILES", "2000"))
+
+class ByteLRU:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key):
+        value = self._items.get(key)
+        if value is not None:
+            self._items.move_to_end(key)
+        return value
+
+    def put(self, key, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        old = self._items.pop(key, None)
+        if old is not None:
+            self.size -= len(old)
+        self._items[key] = value
+        self.size += len(value)
+        while self.size > self.max_bytes:
+            _, evicted = self._items.popitem(last=False)
+            self.size -= len(evicted)
+
+    def clear(self):
+        self._items.clear()
+        self.size = 0
+
+class CoverCache:
+    # Memory tier: already-fitted RGBA backdrops as raw bytes, keyed by
+    # (url, size), bounded by total bytes. Disk tier: the original cover
+    # bytes under data/covers, so a restart only costs a re-fit.
+    def __init__(self, path: str = COVER_DIR, max_bytes: int = COVER_MEMORY_BYTES, max_files: int = COVER_DISK_FILES):
+        self.path = path
+        self.max_files = max_files
+        self.backdrops = ByteLRU(max_bytes)
+        self.counters = {"memory_hits": 0, "memory_misses": 0, "disk_hits": 0, "downloads": 0, "coalesced": 0}
+        self._inflight = {}
+        self._writes = 0
+        os.makedirs(path, exist_ok=True)
+
+    def _file(self, url: str) -> str:
+        return os.path.join(self.path, hashlib.sha1(url.encode()).hexdigest())
+
+    def get_backdrop(self, url: str, size) -> bytes | None:
+        raw = self.backdrops.get((url, tuple(size)))
+        self.counters["memory_hits" if raw is not None else "memory_misses"] += 1
+        return raw
+
+    def put_backdrop(self, url: str, size, raw: bytes):
+        self.backdrops.put((url, tuple(size)), raw)
+
+    async def fetch(self, url: str) -> bytes:
+        task = self._inflight.get(url)
+        if task is None:
+            task = asyncio.ensure_future(self._load(url))
+            self._inflight[url] = task
+            task.add_done_callback(lambda _: self._inflight.pop(url, None))
+        else:
+            self.counters["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    async def _load(self, url: str) -> bytes:
+        path = self._file(url)
+        data = await asyncio.to_thread(_read_file, path)
+        if data is not None:
+            self.counters["disk_hits"] += 1
+            return data
+
+        data = await http.get_bytes(url)
+        self.counters["downloads"] += 1
+
+        await asyncio.to_thread(self._write_file, path, data)
+        return data
+
+    def _write_file(self, path: str, data: bytes):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)
+
+        self._writes += 1
+        if self._writes % 100 == 0:
+            self._prune()
+
+    def _prune(self):
+        entries = [e for e in os.scandir(self.path) if e.is_file() and not e.name.endswith(".tmp")]
+        if len(entries) <= self.max_files:
+            return
+        entries.sort(key=lambda e: e.stat().st_atime)
+        for entry in entries[:len(entries) - self.max_files]:
+            try:
+                os.remove(entry.path)
+            except OSError:
+                pass
+
+    def stats(self) -> dict:
+        return {
+            **self.counters,
+            "memory_entries": len(self.backdrops),
+            "memory_bytes": self.backdrops.size,
+        }
+
+def _read_file(path: str) -> bytes | None:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+covers = CoverCache()
@@ -0,0 +1,62 @@
+import asyncio
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from utils.metrics import metrics
+
+DEFAULT_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+)
+# How long a write waits for another process's lock before failing with
+# "database is locked". users.db and lyrics.db are shared by every shard
+# process, so there it is expected to wait now and then.
+SQLITE_BUSY_TIMEOUT_MS = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+class SQLiteThread:
+    # A long-lived SQLite connection owned by one worker thread. Callers
+    # hand it a function taking the connection; the event loop only awaits.
+    def __init__(self, path: str, init=None, pragmas=DEFAULT_PRAGMAS, name: str = "sqlite"):
+        self.path = path
+        self.init = init
+        self.pragmas = pragmas
+        self.name = name
+        self._executor = None
+        self._conn = None
+
+    def _connect(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        conn = sqlite3.connect(self.path, isolation_level=None, cached_statements=256)
+        conn.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        for pragma in self.pragmas:
+            conn.execute(pragma)
+        if self.init is not None:
+            self.init(conn)
+        self._conn = conn
+
+    def _call(self, fn, args):
+        if self._conn is None:
+            self._connect()
+        return fn(self._conn, *args)
+
+    async def run(self, fn, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix=self.name)
+        loop = asyncio.get_running_loop()
+        # Includes time spent waiting behind other calls on the thread.
+        with metrics.track("db_call", db=self.name, op=fn.__name__.lstrip("_")):
+            return await loop.run_in_executor(self._executor, self._call, fn, args)
+
+    def _close(self):
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.submit(self._close).result()
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,90 @@
+import io
+import os
+
+from PIL import Image
+
+# Encoding specs are "<format>[:<value>]":
+#   png[:level]        zlib level 0-9 (default 6)
+#   webp[:quality]     lossy WebP, quality 0-100 (default 80)
+#   webp-lossless      lossless WebP
+#   jpeg[:quality]     no alpha; transparent areas are flattened
+# Tiers scale the output: full (1x) or compact (0.5x).
+# IMAGE_ENCODING / IMAGE_TIER set the default; IMAGE_ENCODING_<COMMAND> /
+# IMAGE_TIER_<COMMAND> (e.g. IMAGE_ENCODING_SP) override it per command.
+IMAGE_ENCODING = os.getenv("IMAGE_ENCODING", "png")
+IMAGE_TIER = os.getenv("IMAGE_TIER", "full")
+
+TIERS = {"full": 1.0, "compact": 0.5}
+EXTENSIONS = {"png": "png", "webp": "webp", "webp-lossless": "webp", "jpeg": "jpg"}
+DEFAULT_VALUES = {"png": 6, "webp": 80, "webp-lossless": 80, "jpeg": 85}
+WEBP_METHOD = int(os.getenv("WEBP_METHOD", "4"))
+# Discord's dark theme background, used behind transparent pixels for JPEG.
+FLATTEN_BACKGROUND = (49, 51, 56)
+
+class EncodingPolicy:
+    __slots__ = ("format", "value", "tier")
+
+    def __init__(self, format: str = "png", value: int | None = None, tier: str = "full"):
+        if format not in EXTENSIONS:
+            raise ValueError(f"unknown image format {format!r}")
+        if tier not in TIERS:
+            raise ValueError(f"unknown size tier {tier!r}")
+        self.format = format
+        self.value = DEFAULT_VALUES[format] if value is None else value
+        self.tier = tier
+
+    @classmethod
+    def parse(cls, spec: str, tier: str = "full") -> "EncodingPolicy":
+        format, _, value = spec.strip().lower().partition(":")
+        return cls(format, int(value) if value else None, tier.strip().lower())
+
+    @property
+    def spec(self) -> str:
+        return f"{self.format}:{self.value}/{self.tier}"
+
+    @property
+    def extension(self) -> str:
+        return EXTENSIONS[self.format]
+
+    @property
+    def scale(self) -> float:
+        return TIERS[self.tier]
+
+    @property
+    def spliceable(self) -> bool:
+        # Full-size PNG is the only output that can be assembled from
+        # separately compressed parts (see utils.pngsplice).
+        return self.format == "png" and self.tier == "full"
+
+    def filename(self, stem: str) -> str:
+        return f"{stem}.{self.extension}"
+
+    def encode(self, image: Image.Image) -> bytes:
+        if self.scale != 1.0:
+            size = (max(round(image.width * self.scale), 1), max(round(image.height * self.scale), 1))
+            image = image.resize(size, Image.LANCZOS)
+
+        buf = io.BytesIO()
+        if self.format == "png":
+            image.save(buf, format="PNG", compress_level=self.value)
+        elif self.format == "webp":
+            image.save(buf, format="WEBP", quality=self.value, method=WEBP_METHOD)
+        elif self.format == "webp-lossless":
+            image.save(buf, format="WEBP", lossless=True, quality=self.value, method=WEBP_METHOD)
+        else:
+            if image.mode in ("RGBA", "LA"):
+                flat = Image.new("RGB", image.size, FLATTEN_BACKGROUND)
+                flat.paste(image, mask=image.getchannel("A"))
+                image = flat
+            image.save(buf, format="JPEG", quality=self.value)
+        return buf.getvalue()
+
+def policy_for(command: str) -> EncodingPolicy:
+    name = command.upper()
+    spec = os.getenv(f"IMAGE_ENCODING_{name}", IMAGE_ENCODING)
+    tier = os.getenv(f"IMAGE_TIER_{name}", IMAGE_TIER)
+    try:
+        return EncodingPolicy.parse(spec, tier)
+    except ValueError as e:
+        print(f"Bad image encoding for {command} ({spec}, {tier}), using png: {e}")
+        return EncodingPolicy()
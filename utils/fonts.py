@@ -0,0 +1,51 @@
+import os
+from functools import lru_cache
+
+from PIL import ImageFont
+
+FONT_DIR = "fonts"
+REGULAR = (os.path.join(FONT_DIR, "DejaVuSans.ttf"),)
+BOLD = (os.path.join(FONT_DIR, "DejaVuSans-Bold.ttf"),)
+
+ELLIPSIS = "..."
+
+@lru_cache(maxsize=None)
+def get_font(possible_names: tuple, size: int):
+    for name in possible_names:
+        try:
+            return ImageFont.truetype(name, size)
+        except Exception:
+            continue
+    return ImageFont.load_default()
+
+def load_font(possible_names, size: int):
+    return get_font(tuple(possible_names), size)
+
+@lru_cache(maxsize=2048)
+def layout_text(text: str, possible_names: tuple, max_width: int, max_size: int, min_size: int, step: int = 2):
+    # Text width grows with the font size, so the largest size that fits and
+    # the longest prefix that fits with an ellipsis are both binary searches.
+    sizes = list(range(max_size, min_size - 1, -step))[::-1]
+    lo, hi = 0, len(sizes) - 1
+    best = None
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if get_font(possible_names, sizes[mid]).getlength(text) <= max_width:
+            best = sizes[mid]
+            lo = mid + 1
+        else:
+            hi = mid - 1
+    if best is not None:
+        return best, text
+
+    font = get_font(possible_names, min_size)
+    lo, hi = 0, len(text) - 1
+    keep = 0
+    while lo <= hi:
+        mid = (lo + hi) // 2
+        if font.getlength(text[:mid] + ELLIPSIS) <= max_width:
+            keep = mid
+            lo = mid + 1
+        else:
+            hi = mid - 1
+    return min_size, text[:keep] + ELLIPSIS
@@ -0,0 +1,135 @@
+import json
+import os
+import time
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+import aiohttp
+
+from utils.metrics import metrics
+
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+HTTP_MAX_BYTES = int(os.getenv("HTTP_MAX_BYTES", str(8 * 1024 * 1024)))
+HTTP_PER_HOST = int(os.getenv("HTTP_PER_HOST", "8"))
+HTTP_DNS_TTL = int(os.getenv("HTTP_DNS_TTL", "300"))
+HTTP_KEEPALIVE = float(os.getenv("HTTP_KEEPALIVE", "30"))
+
+USER_AGENT = "Fozi"
+
+class ResponseTooLarge(Exception):
+    pass
+
+class BadStatus(Exception):
+    def __init__(self, url: str, status: int):
+        super().__init__(f"GET {url} returned {status}")
+        self.url = url
+        self.status = status
+
+class Response:
+    def __init__(self, status: int, headers, body: bytes, charset: str | None):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.charset = charset
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 300
+
+    def text(self) -> str:
+        return self.body.decode(self.charset or "utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.body)
+
+class HostStats:
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def record(self, elapsed_ms: float, error: bool):
+        self.requests += 1
+        self.errors += error
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+
+    def as_dict(self) -> dict:
+        avg = self.total_ms / self.requests if self.requests else 0.0
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "avg_ms": round(avg, 1),
+            "max_ms": round(self.max_ms, 1),
+        }
+
+class HTTPClient:
+    # One pooled session for the lifetime of the bot. Opened in setup_hook,
+    # closed on shutdown; anything that runs before that (scripts,
+    # benchmarks) gets a session on first use.
+    def __init__(self, timeout: float = HTTP_TIMEOUT, max_bytes: int = HTTP_MAX_BYTES):
+        self.timeout = timeout
+        self.max_bytes = max_bytes
+        self.hosts = defaultdict(HostStats)
+        self._session = None
+
+    async def start(self):
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit_per_host=HTTP_PER_HOST,
+                ttl_dns_cache=HTTP_DNS_TTL,
+                keepalive_timeout=HTTP_KEEPALIVE,
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers={"User-Agent": USER_AGENT},
+            )
+        return self
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def get(self, url: str, *, params=None, timeout: float | None = None, max_bytes: int | None = None) -> Response:
+        await self.start()
+        limit = max_bytes or self.max_bytes
+        kwargs = {"params": params}
+        if timeout is not None:
+            kwargs["timeout"] = aiohttp.ClientTimeout(total=timeout)
+
+        host = urlsplit(url).hostname or "?"
+        started = time.perf_counter()
+        error = True
+        try:
+            async with self._session.get(url, **kwargs) as resp:
+                if resp.content_length is not None and resp.content_length > limit:
+                    raise ResponseTooLarge(f"{host} sent {resp.content_length} bytes (limit {limit})")
+
+                body = bytearray()
+                async for chunk in resp.content.iter_chunked(64 * 1024):
+                    body.extend(chunk)
+                    if len(body) > limit:
+                        raise ResponseTooLarge(f"{host} sent more than {limit} bytes")
+
+                error = resp.status >= 400
+                return Response(resp.status, resp.headers, bytes(body), resp.charset)
+        finally:
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.hosts[host].record(elapsed_ms, error)
+            metrics.observe("http_request_ms", elapsed_ms, host=host)
+            if error:
+                metrics.inc("http_request_errors_total", host=host)
+
+    async def get_bytes(self, url: str, **kwargs) -> bytes:
+        resp = await self.get(url, **kwargs)
+        if not resp.ok:
+            raise BadStatus(url, resp.status)
+        return resp.body
+
+    def stats(self) -> dict:
+        return {host: stats.as_dict() for host, stats in sorted(self.hosts.items())}
+
+http = HTTPClient()
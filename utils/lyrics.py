@@ -1,16 +1,161 @@
-import aiohttp
+import asyncio
+import os
 import re
-from bs4 import BeautifulSoup
+from html.parser import HTMLParser
+
+from utils.httpclient import http
 
 GENIUS_SEARCH_URL = "https://genius.com/api/search/multi"
+LYRICS_EXTRACTOR = os.getenv("LYRICS_EXTRACTOR", "stream")
+
+CONTAINER_ATTR = "data-lyrics-container"
+CONTAINER_MARKER = 'data-lyrics-container="true"'
+
+def clean(lyrics: str) -> str:
+    lyrics = re.sub(r"(?si)^.*?\bLyrics\b", "", lyrics).strip()
+    lyrics = re.sub(r"(?si)(translations|read more|\d+ contributors|\b[a-z]+ \(.*?\))", "", lyrics).strip()
+    return lyrics
+
+# bs4 is only imported by the extractors that use it; the default stream
+# extractor needs nothing beyond the standard library.
+
+class SoupExtractor:
+    # The original approach: build the whole document tree.
+    name = "soup"
+
+    def extract(self, html: str) -> list[str]:
+        from bs4 import BeautifulSoup
+        soup = BeautifulSoup(html, "html.parser")
+        divs = soup.find_all("div", attrs={CONTAINER_ATTR: "true"})
+        return [div.get_text(separator="\n").strip() for div in divs]
+
+class StrainedExtractor:
+    # Only the lyrics containers (and their children) become tree nodes.
+    name = "strained"
+
+    def extract(self, html: str) -> list[str]:
+        from bs4 import BeautifulSoup, SoupStrainer
+        strainer = SoupStrainer("div", attrs={CONTAINER_ATTR: "true"})
+        soup = BeautifulSoup(html, "html.parser", parse_only=strainer)
+        divs = soup.find_all("div", attrs={CONTAINER_ATTR: "true"}, recursive=False)
+        return [div.get_text(separator="\n").strip() for div in divs]
+
+class _ContainerParser(HTMLParser):
+    def __init__(self, expected: int):
+        super().__init__(convert_charrefs=True)
+        self.expected = expected
+        self.blocks = []
+        self.done = False
+        self._parts = None
+        self._text = []
+        self._depth = 0
+        self._skip = 0
+
+    def _flush(self):
+        # feed() hands over whatever text it has at the end of each chunk, so
+        # one text run can arrive in several calls. Like soup's strings, a
+        # part only ends at a tag.
+        if self._text:
+            self._parts.append("".join(self._text))
+            self._text = []
+
+    def handle_starttag(self, tag, attrs):
+        if self._parts is not None:
+            self._flush()
+        if tag in ("script", "style") and self._parts is not None:
+            self._skip += 1
+        if tag != "div":
+            return
+        if self._parts is not None:
+            self._depth += 1
+        elif dict(attrs).get(CONTAINER_ATTR) == "true":
+            self._parts = []
+            self._depth = 1
+
+    def handle_endtag(self, tag):
+        if self._parts is not None:
+            self._flush()
+        if tag in ("script", "style") and self._skip:
+            self._skip -= 1
+        if tag != "div" or self._parts is None:
+            return
+        self._depth -= 1
+        if self._depth == 0:
+            self.blocks.append("\n".join(self._parts).strip())
+            self._parts = None
+            if len(self.blocks) >= self.expected:
+                self.done = True
+
+    def handle_comment(self, data):
+        if self._parts is not None:
+            self._flush()
+
+    def handle_data(self, data):
+        if self._parts is not None and not self._skip:
+            self._text.append(data)
+
+class StreamExtractor:
+    # Skips straight to the first container, then feeds the page in small
+    # chunks past the last container marker and stops as soon as that
+    # container has been closed. It only looks for the double-quoted marker,
+    # so pages it finds nothing in (single-quoted attributes, say) go
+    # through StrainedExtractor instead.
+    name = "stream"
+    chunk_size = 4 * 1024
+
+    def extract(self, html: str) -> list[str]:
+        blocks = self._extract(html)
+        if not blocks:
+            return StrainedExtractor().extract(html)
+        return blocks
+
+    def _extract(self, html: str) -> list[str]:
+        expected = html.count(CONTAINER_MARKER)
+        if not expected:
+            return []
+        start = max(html.rfind("<", 0, html.find(CONTAINER_MARKER)), 0)
+        # A marker inside a <script> isn't a container; start after the
+        # script and let the parser find the real one.
+        script = html.rfind("<script", 0, start)
+        if script > html.rfind("</script", 0, start):
+            start = html.find("</script", start)
+            if start < 0:
+                return []
+        pos = max(html.rfind(CONTAINER_MARKER), start)
+
+        parser = _ContainerParser(expected)
+        parser.feed(html[start:pos])
+        while pos < len(html) and not parser.done:
+            parser.feed(html[pos:pos + self.chunk_size])
+            pos += self.chunk_size
+        if not parser.done:
+            parser.close()
+            if parser._parts is not None:
+                # The last container was never closed.
+                parser._flush()
+                parser.blocks.append("\n".join(parser._parts).strip())
+        return parser.blocks
+
+EXTRACTORS = {cls.name: cls for cls in (SoupExtractor, StrainedExtractor, StreamExtractor)}
+
+def get_extractor(name: str = LYRICS_EXTRACTOR):
+    return EXTRACTORS.get(name, StreamExtractor)()
+
+def extract_lyrics(html: str, extractor=None) -> str | None:
+    blocks = (extractor or get_extractor()).extract(html)
+    if not blocks:
+        return None
+
+    lyrics = "\n".join(blocks)
+    lyrics = re.sub(r'\n{3,}', '\n\n', lyrics).strip()
+    return clean(lyrics) or None
 
 async def fetch(artist: str, title: str) -> str | None:
     query = f"{title} {artist}"
-    async with aiohttp.ClientSession() as session:
-        async with session.get(GENIUS_SEARCH_URL, params={"q": query}) as resp:
-            if resp.status != 200:
-                return None
-            data = await resp.json()
+    resp = await http.get(GENIUS_SEARCH_URL, params={"q": query})
+    if resp.status != 200:
+        return None
+    data = resp.json()
 
     hits = [
         section for section in data["response"]["sections"]
@@ -21,17 +166,8 @@ async def fetch(artist: str, title: str) -> str | None:
 
     url = hits[0]["hits"][0]["result"]["url"]
 
-    async with aiohttp.ClientSession() as session:
-        async with session.get(url) as page:
-            if page.status != 200:
-                return None
-            html = await page.text()
-
-    soup = BeautifulSoup(html, "html.parser")
-    lyrics_divs = soup.find_all("div", attrs={"data-lyrics-container": "true"})
-    if not lyrics_divs:
+    page = await http.get(url)
+    if page.status != 200:
         return None
 
-    lyrics = "\n".join(div.get_text(separator="\n").strip() for div in lyrics_divs)
-    lyrics = re.sub(r'\n{3,}', '\n\n', lyrics).strip()
-    return lyrics
+    return await asyncio.to_thread(extract_lyrics, page.text())
@@ -0,0 +1,107 @@
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict
+
+from utils.dbthread import SQLiteThread
+
+# Shared by every shard process, like users.db: lookups are keyed by song,
+# not guild, so one cache serves all shards.
+LYRICS_DB_PATH = os.path.join("data", "lyrics.db")
+LYRICS_TTL = float(os.getenv("LYRICS_TTL", str(7 * 86400)))
+LYRICS_NEGATIVE_TTL = float(os.getenv("LYRICS_NEGATIVE_TTL", "900"))
+LYRICS_MEMORY_ENTRIES = int(os.getenv("LYRICS_MEMORY_ENTRIES", "512"))
+
+def normalize(artist: str, title: str) -> str:
+    def norm(s):
+        s = s.lower()
+        s = re.sub(r"\s*[\(\[](feat|ft|with)\.?\s[^\)\]]*[\)\]]", "", s)
+        s = re.sub(r"\s+-\s+.*?(remaster(ed)?|version|edit|live).*$", "", s)
+        s = re.sub(r"[^\w]+", " ", s)
+        return s.strip()
+    return f"{norm(artist)}\x1f{norm(title)}"
+
+def _init(conn):
+    conn.execute('''
+        CREATE TABLE IF NOT EXISTS lyrics (
+            key TEXT PRIMARY KEY,
+            lyrics TEXT,
+            expires_at REAL NOT NULL
+        )
+    ''')
+
+def _load(conn, key):
+    return conn.execute("SELECT lyrics, expires_at FROM lyrics WHERE key = ?", (key,)).fetchone()
+
+def _save(conn, key, lyrics, expires_at):
+    conn.execute(
+        "INSERT INTO lyrics (key, lyrics, expires_at) VALUES (?, ?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET lyrics = excluded.lyrics, expires_at = excluded.expires_at",
+        (key, lyrics, expires_at),
+    )
+
+def _purge(conn, now):
+    return conn.execute("DELETE FROM lyrics WHERE expires_at < ?", (now,)).rowcount
+
+class LyricsStore:
+    # Found lyrics live for LYRICS_TTL, "not found" for LYRICS_NEGATIVE_TTL.
+    # An in-memory LRU sits in front of data/lyrics.db and concurrent
+    # lookups for the same track share a single upstream fetch.
+    def __init__(self, path: str = LYRICS_DB_PATH, max_entries: int = LYRICS_MEMORY_ENTRIES):
+        self.db = SQLiteThread(path, init=_init, name="lyrics-db")
+        self.max_entries = max_entries
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "fetches": 0, "coalesced": 0}
+        self._memory = OrderedDict()
+        self._inflight = {}
+
+    def _remember(self, key, lyrics, expires_at):
+        self._memory[key] = (lyrics, expires_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    async def get(self, artist: str, title: str, loader) -> str | None:
+        key = normalize(artist, title)
+        now = time.time()
+
+        entry = self._memory.get(key)
+        if entry is not None and entry[1] > now:
+            self._memory.move_to_end(key)
+            self.counters["memory_hits"] += 1
+            return entry[0]
+
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(self._resolve(key, artist, title, loader))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.counters["coalesced"] += 1
+        return await asyncio.shield(task)
+
+    async def _resolve(self, key, artist, title, loader):
+        row = await self.db.run(_load, key)
+        if row is not None and row[1] > time.time():
+            self.counters["disk_hits"] += 1
+            self._remember(key, row[0], row[1])
+            return row[0]
+
+        self.counters["fetches"] += 1
+        lyrics = await loader(artist, title)
+        ttl = LYRICS_TTL if lyrics else LYRICS_NEGATIVE_TTL
+        expires_at = time.time() + ttl
+        self._remember(key, lyrics, expires_at)
+        await self.db.run(_save, key, lyrics, expires_at)
+        return lyrics
+
+    async def purge(self) -> int:
+        return await self.db.run(_purge, time.time())
+
+    def stats(self) -> dict:
+        return {**self.counters, "memory_entries": len(self._memory)}
+
+    def close(self):
+        self.db.close()
+
+lyrics_store = LyricsStore()
@@ -0,0 +1,176 @@
+import asyncio
+import bisect
+import os
+import time
+from contextlib import contextmanager
+
+from aiohttp import web
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+LOOP_LAG_INTERVAL = float(os.getenv("LOOP_LAG_INTERVAL", "0.5"))
+
+BUCKETS_MS = (1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+class Histogram:
+    # Fixed millisecond buckets, Prometheus style. Quantiles are estimated
+    # by interpolating inside the bucket the rank falls into.
+    def __init__(self, buckets=BUCKETS_MS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            if seen + n >= rank and n:
+                lo = self.buckets[i - 1] if i else 0.0
+                hi = self.buckets[i] if i < len(self.buckets) else self.max
+                return min(lo + (hi - lo) * (rank - seen) / n, self.max)
+            seen += n
+        return self.max
+
+def _labels(labels: dict) -> tuple:
+    return tuple(sorted(labels.items()))
+
+def _format(name: str, labels: tuple, extra: tuple = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return name
+    inner = ",".join(f'{k}="{v}"' for k, v in pairs)
+    return f"{name}{{{inner}}}"
+
+class Metrics:
+    # Process-wide counters, gauges and latency histograms, keyed by metric
+    # name plus a sorted label tuple.
+    def __init__(self):
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = (name, _labels(labels))
+        self.counters[key] = self.counters.get(key, 0) + value
+
+    def gauge_add(self, name: str, delta: float, **labels):
+        key = (name, _labels(labels))
+        self.gauges[key] = self.gauges.get(key, 0) + delta
+
+    def gauge_set(self, name: str, value: float, **labels):
+        self.gauges[(name, _labels(labels))] = value
+
+    def observe(self, name: str, value_ms: float, **labels):
+        key = (name, _labels(labels))
+        hist = self.histograms.get(key)
+        if hist is None:
+            hist = self.histograms[key] = Histogram()
+        hist.observe(value_ms)
+
+    @contextmanager
+    def track(self, name: str, **labels):
+        # Times the block into `<name>_ms`, counts failures in
+        # `<name>_errors_total` and keeps `<name>_in_flight` current.
+        self.gauge_add(f"{name}_in_flight", 1, **labels)
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.inc(f"{name}_errors_total", **labels)
+            raise
+        finally:
+            self.observe(f"{name}_ms", (time.perf_counter() - started) * 1000, **labels)
+            self.gauge_add(f"{name}_in_flight", -1, **labels)
+
+    def histogram(self, name: str, **labels) -> Histogram | None:
+        return self.histograms.get((name, _labels(labels)))
+
+    def render(self) -> str:
+        lines = []
+        for (name, labels), value in sorted(self.counters.items()):
+            lines.append(f"{_format(name, labels)} {value}")
+        for (name, labels), value in sorted(self.gauges.items()):
+            lines.append(f"{_format(name, labels)} {value}")
+        for (name, labels), hist in sorted(self.histograms.items(), key=lambda item: item[0]):
+            cumulative = 0
+            for bound, n in zip(hist.buckets, hist.counts):
+                cumulative += n
+                lines.append(f"{_format(name + '_bucket', labels, (('le', bound),))} {cumulative}")
+            lines.append(f"{_format(name + '_bucket', labels, (('le', '+Inf'),))} {hist.count}")
+            lines.append(f"{_format(name + '_sum', labels)} {round(hist.sum, 3)}")
+            lines.append(f"{_format(name + '_count', labels)} {hist.count}")
+        return "\n".join(lines) + "\n"
+
+    def summary(self, name: str) -> list:
+        # (labels, count, errors, in flight, p50, p95, max) for one tracked name.
+        rows = []
+        for (hist_name, labels), hist in sorted(self.histograms.items(), key=lambda item: item[0]):
+            if hist_name != f"{name}_ms":
+                continue
+            rows.append((
+                dict(labels),
+                hist.count,
+                self.counters.get((f"{name}_errors_total", labels), 0),
+                self.gauges.get((f"{name}_in_flight", labels), 0),
+                round(hist.quantile(0.5), 1),
+                round(hist.quantile(0.95), 1),
+                round(hist.max, 1),
+            ))
+        return rows
+
+    async def loop_lag_monitor(self, interval: float = LOOP_LAG_INTERVAL):
+        # Sleeps for `interval` and records how late it woke up; anything
+        # blocking the loop shows up here.
+        loop = asyncio.get_running_loop()
+        while True:
+            started = loop.time()
+            await asyncio.sleep(interval)
+            lag = max(loop.time() - started - interval, 0) * 1000
+            self.observe("event_loop_lag_ms", lag)
+            self.gauge_set("event_loop_lag_last_ms", round(lag, 3))
+
+metrics = Metrics()
+
+class MetricsServer:
+    # Serves metrics.render() at /metrics for a local Prometheus scrape.
+    def __init__(self, metrics: Metrics = metrics, host: str = METRICS_HOST, port: int = METRICS_PORT):
+        self.metrics = metrics
+        self.host = host
+        self.port = port
+        self._runner = None
+
+    async def _handle(self, request):
+        return web.Response(text=self.metrics.render(), content_type="text/plain", charset="utf-8")
+
+    async def start(self):
+        if not self.port or self._runner is not None:
+            return
+        app = web.Application()
+        app.router.add_get("/metrics", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        try:
+            await web.TCPSite(self._runner, self.host, self.port).start()
+        except OSError as e:
+            print(f"Metrics endpoint disabled, could not bind {self.host}:{self.port}: {e}")
+            await self._runner.cleanup()
+            self._runner = None
+            return
+        print(f"Metrics on http://{self.host}:{self.port}/metrics")
+
+    async def close(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+metrics_server = MetricsServer()
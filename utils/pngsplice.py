@@ -0,0 +1,74 @@
+import io
+import struct
+import zlib
+
+from PIL import Image
+
+# Builds a PNG from a top part compressed once and a bottom part compressed
+# per request. The top's deflate stream ends with a full flush, so the
+# bottom can be compressed by a fresh compressor and appended; only the
+# adler32 has to be carried over.
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+ZLIB_HEADER = b"\x78\x9c"
+COLOR_TYPES = {"RGB": 2, "RGBA": 6}
+
+def _chunk(tag: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+
+def filtered_scanlines(image: Image.Image) -> bytes:
+    # Pillow chooses a filter per row; a level-1 encode and an inflate is
+    # the cheapest way to get its filtered rows back.
+    buf = io.BytesIO()
+    image.save(buf, format="PNG", compress_level=1)
+    data = memoryview(buf.getvalue())[len(PNG_SIGNATURE):]
+    idat = []
+    while data:
+        length = struct.unpack(">I", data[:4])[0]
+        if data[4:8] == b"IDAT":
+            idat.append(data[8:8 + length])
+        data = data[12 + length:]
+    return zlib.decompress(b"".join(idat))
+
+class PNGPrefix:
+    __slots__ = ("size", "mode", "data", "adler", "last_row")
+
+    def __init__(self, size, mode, data, adler, last_row):
+        self.size = size
+        self.mode = mode
+        self.data = data
+        self.adler = adler
+        self.last_row = last_row
+
+    def __len__(self):
+        return len(self.data) + len(self.last_row)
+
+def compress_prefix(image: Image.Image, level: int = 9) -> PNGPrefix:
+    lines = filtered_scanlines(image)
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    data = compressor.compress(lines) + compressor.flush(zlib.Z_FULL_FLUSH)
+    width, height = image.size
+    last_row = image.crop((0, height - 1, width, height)).tobytes()
+    return PNGPrefix(image.size, image.mode, data, zlib.adler32(lines), last_row)
+
+def finish_png(prefix: PNGPrefix, tail: Image.Image, level: int = 6) -> bytes:
+    width = prefix.size[0]
+    if tail.mode != prefix.mode or tail.size[0] != width:
+        raise ValueError("tail must match the prefix mode and width")
+
+    # The tail's first row may be filtered against the row above it, so
+    # filter it with the prefix's last row on top and drop that row again.
+    joined = Image.new(prefix.mode, (width, tail.size[1] + 1))
+    joined.paste(Image.frombytes(prefix.mode, (width, 1), prefix.last_row), (0, 0))
+    joined.paste(tail, (0, 1))
+    stride = width * Image.getmodebands(prefix.mode) + 1
+    lines = filtered_scanlines(joined)[stride:]
+
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    body = compressor.compress(lines) + compressor.flush()
+    adler = zlib.adler32(lines, prefix.adler)
+
+    height = prefix.size[1] + tail.size[1]
+    header = struct.pack(">IIBBBBB", width, height, 8, COLOR_TYPES[prefix.mode], 0, 0, 0)
+    idat = ZLIB_HEADER + prefix.data + body + struct.pack(">I", adler)
+    return PNG_SIGNATURE + _chunk(b"IHDR", header) + _chunk(b"IDAT", idat) + _chunk(b"IEND", b"")
@@ -0,0 +1,71 @@
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+RENDER_WORKERS = int(os.getenv("RENDER_WORKERS", "2"))
+RENDER_QUEUE_SIZE = int(os.getenv("RENDER_QUEUE_SIZE", "16"))
+
+class RenderQueueFull(Exception):
+    pass
+
+class RenderEngine:
+    # CPU-bound Pillow work runs in worker processes so the event loop keeps
+    # serving gateway events. At most `workers` jobs run at once and at most
+    # `queue_size` more may wait for a slot; anything beyond that is rejected.
+    def __init__(self, workers: int = RENDER_WORKERS, queue_size: int = RENDER_QUEUE_SIZE):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = None
+        self._slots = None
+        self._waiting = 0
+
+    def start(self):
+        if self._executor is None:
+            if self.workers > 0:
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render")
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(max(self.workers, 1))
+        return self
+
+    @property
+    def pending(self) -> int:
+        return self._waiting
+
+    async def submit(self, fn, *args):
+        self.start()
+        if self._waiting >= self.queue_size:
+            raise RenderQueueFull()
+
+        slots = self._slots
+        self._waiting += 1
+        try:
+            await slots.acquire()
+        finally:
+            self._waiting -= 1
+
+        executor = self.start()._executor
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(executor, fn, *args)
+        except BrokenProcessPool:
+            # A worker died (OOM kill, a crash in a codec) and the pool is
+            # unusable from now on. This job fails; the next one gets a
+            # fresh pool.
+            if self._executor is executor:
+                print("Render worker died, restarting the render pool")
+                executor.shutdown(wait=False, cancel_futures=True)
+                self._executor = None
+            raise
+        finally:
+            slots.release()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+            self._slots = None
+
+engine = RenderEngine()
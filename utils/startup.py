@@ -0,0 +1,37 @@
+import time
+from contextlib import contextmanager
+
+from utils.metrics import metrics
+
+class StartupTimer:
+    # Records how long each startup phase took. Phases are either timed
+    # blocks or marks measured from the end of the previous phase; offsets
+    # are relative to when this module was first imported.
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.phases = []
+        self._last = self.started
+
+    def _record(self, name: str, started: float, ended: float):
+        ms = (ended - started) * 1000
+        self.phases.append((name, (started - self.started) * 1000, ms))
+        metrics.gauge_set("startup_phase_ms", round(ms, 1), phase=name)
+        self._last = max(self._last, ended)
+
+    def mark(self, name: str):
+        self._record(name, self._last, time.perf_counter())
+
+    @contextmanager
+    def phase(self, name: str):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self._record(name, started, time.perf_counter())
+
+    def report(self) -> str:
+        width = max((len(name) for name, _, _ in self.phases), default=0) + 2
+        lines = [f"{name.ljust(width)} +{offset:8.1f}ms {ms:8.1f}ms" for name, offset, ms in self.phases]
+        return "\n".join(lines)
+
+startup = StartupTimer()